@@ -0,0 +1,199 @@
+import pandas as pd
+
+from cache import artifact_name, cached_artifact, make_key
+from data_preprocessing import POLLUTANT_AQI_COLUMNS, POLLUTANT_MAX_COLUMNS, POLLUTANT_MEAN_COLUMNS
+from downsampling import point_budget
+from pipeline import code_fingerprint, dataset_version, default_source, load_clean_data
+from profiling import span
+
+# Measures summarised in the State x Month x Pollutant cube
+CUBE_MEASURES = POLLUTANT_AQI_COLUMNS + POLLUTANT_MEAN_COLUMNS
+# Measures of the per-city daily table behind the city panels
+CITY_DATE_MEASURES = POLLUTANT_AQI_COLUMNS + POLLUTANT_MAX_COLUMNS
+
+AGGREGATE_MODULES = ['aggregates.py']
+
+# Resolutions of the trend pyramid, finest first, as pandas period frequencies. Each period
+# is labelled by its last day (weeks end on Sunday), as resample('ME') labels months.
+TREND_RESOLUTIONS = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+# Groups the trends are kept for: all sites together, each State and each City
+TREND_LEVELS = {'all': [], 'State': ['State'], 'City': ['State', 'City']}
+# Periods of the rolling mean of the smoothed trends, the dashboards' 7 months at monthly resolution
+TREND_WINDOW = 7
+
+
+# State x Month x Pollutant table with count, sum, sum of squares, mean and median.
+# Counts, sums and sums of squares roll up exactly to coarser levels (state, month).
+def state_month_stats(data, measures=CUBE_MEASURES):
+    measures = [measure for measure in measures if measure in data.columns]
+    month = data['Date Local'].dt.month.rename('Month')
+    values = data[measures].astype('float64')
+    grouped = values.groupby([data['State'], month], observed=True)
+    squares = (values ** 2).groupby([data['State'], month], observed=True)
+    stats = pd.concat({
+        'count': grouped.count(),
+        'sum': grouped.sum(),
+        'sumsq': squares.sum(),
+        'median': grouped.median(),
+    }, axis=1)
+    stats = stats.stack(level=1).rename_axis(['State', 'Month', 'Pollutant'])
+    stats['mean'] = stats['sum'] / stats['count']
+    return stats[['count', 'sum', 'sumsq', 'mean', 'median']].sort_index()
+
+
+# Per-day count and sum of each measure across all sites, so any date range is a slice
+def daily_stats(data, measures=CUBE_MEASURES):
+    measures = [measure for measure in measures if measure in data.columns]
+    grouped = data[measures].astype('float64').groupby(data['Date Local'])
+    return pd.concat({'count': grouped.count(), 'sum': grouped.sum()}, axis=1).sort_index()
+
+
+# Last day of the period of each date, midnight included
+def period_end(dates, resolution):
+    return pd.DatetimeIndex(dates).to_period(TREND_RESOLUTIONS[resolution]).to_timestamp(how='end').normalize()
+
+
+# Count and sum of each measure per (State, City, Date Local), the base of the trend
+# pyramid. Rows without a City keep a missing City, so they count towards their State.
+def trend_stats(data, measures=CUBE_MEASURES):
+    measures = [measure for measure in measures if measure in data.columns]
+    grouped = data[measures].astype('float64').groupby([data['State'], data['City'], data['Date Local']],
+                                                       observed=True, dropna=False)
+    stats = pd.concat({'count': grouped.count(), 'sum': grouped.sum()}, axis=1)
+    # Plain labels, so the stats of chunks or partitions concatenate
+    stats.index = stats.index.set_levels([stats.index.levels[i].astype(object) for i in (0, 1)], level=[0, 1])
+    return stats
+
+
+# Per-period means of a level of the pyramid, with their rolling mean over TREND_WINDOW
+# periods of the same group as '<measure>_Rolling' columns
+def with_rolling(means, keys):
+    means = means.astype('float32')
+    if keys:
+        rolling = means.groupby(level=keys, sort=False).rolling(TREND_WINDOW).mean()
+        rolling = rolling.droplevel(list(range(len(keys)))).reindex(means.index)
+    else:
+        rolling = means.rolling(TREND_WINDOW).mean()
+    return pd.concat([means, rolling.add_suffix('_Rolling')], axis=1)
+
+
+# Count and sum of every measure per group and period of each (level, resolution) of the
+# trend pyramid, from trend_stats(). They add up across batches of rows.
+def pyramid_sums(stats):
+    dates = stats.index.get_level_values('Date Local')
+    unique = dates.unique()
+    sums = {}
+    for resolution in TREND_RESOLUTIONS:
+        labels = pd.Series(period_end(unique, resolution), index=unique).reindex(dates)
+        periods = stats.groupby([stats.index.get_level_values('State'), stats.index.get_level_values('City'),
+                                 pd.Index(labels.to_numpy(), name='Date Local')], dropna=False).sum()
+        for level, keys in TREND_LEVELS.items():
+            # Rows without a key are left out of the levels grouped by it
+            sums[(level, resolution)] = periods.groupby(level=keys + ['Date Local']).sum()
+    return sums
+
+
+# Trend pyramid from pyramid_sums(): {(level, resolution): table} of the mean of every
+# measure per group and period, indexed by the level's keys and 'Date Local', so a trend
+# chart reads at most one row per period and group instead of resampling rows
+def pyramid_means(sums):
+    return {(level, resolution): with_rolling(table['sum'] / table['count'], TREND_LEVELS[level])
+            for (level, resolution), table in sums.items()}
+
+
+def trend_pyramid(stats):
+    return pyramid_means(pyramid_sums(stats))
+
+
+# Materialize every table the static panels read, from one pass over the cleaned data
+def build_cube(data):
+    city_measures = [measure for measure in CITY_DATE_MEASURES if measure in data.columns]
+    return {
+        'state_month': state_month_stats(data),
+        'daily': daily_stats(data),
+        'state_median': data.groupby('State', observed=True)[POLLUTANT_AQI_COLUMNS].median(),
+        'correlation': data[POLLUTANT_AQI_COLUMNS].corr(),
+        'city_date': data.groupby(['State', 'City', 'Date Local'], observed=True)[city_measures].median().sort_index(),
+        'pyramid': trend_pyramid(trend_stats(data)),
+    }
+
+
+# Aggregate cube of the cleaned dataset, built once per dataset version
+def load_cube(source=None, columns=None):
+    key = make_key(dataset_version(source, columns), code_fingerprint(AGGREGATE_MODULES))
+
+    def build():
+        # Imported here, incremental builds on this module
+        from incremental import incremental_cube, is_incremental
+
+        # The incremental dataset keeps its cube up to date as rows are appended
+        if is_incremental(source or default_source()):
+            return incremental_cube(source or default_source())
+        return build_cube(load_clean_data(source, columns))
+
+    with span('aggregate_cube'):
+        return cached_artifact(artifact_name('aggregate_cube', columns), key, build)
+
+
+# Mean of each measure per State, rolled up from the monthly sums and counts
+def state_means(cube, measures=POLLUTANT_AQI_COLUMNS):
+    stats = cube['state_month'].loc[(slice(None), slice(None), list(measures)), ['count', 'sum']]
+    totals = stats.groupby(level=['State', 'Pollutant'], observed=True).sum()
+    return (totals['sum'] / totals['count']).unstack('Pollutant')[list(measures)]
+
+
+# Mean of each measure per calendar month across all states
+def monthly_means(cube, measures=POLLUTANT_AQI_COLUMNS):
+    stats = cube['state_month'].loc[(slice(None), slice(None), list(measures)), ['count', 'sum']]
+    totals = stats.groupby(level=['Month', 'Pollutant']).sum()
+    return (totals['sum'] / totals['count']).unstack('Pollutant')[list(measures)]
+
+
+# Mean of each measure per day across all sites, optionally limited to a date range
+def daily_means(cube, measures=POLLUTANT_AQI_COLUMNS, start=None, end=None):
+    daily = cube['daily'].loc[start:end]
+    return daily['sum'][list(measures)] / daily['count'][list(measures)]
+
+
+# Per-day medians for one city, optionally limited to a date range
+def city_daily(cube, state, city, start=None, end=None):
+    # Cubes without the City x Date table query the city on demand (sql_backend.SqlCube)
+    if 'city_date' not in cube:
+        return cube.city_daily(state, city, start, end)
+    table = cube['city_date']
+    try:
+        daily = table.xs((state, city), level=['State', 'City'])
+    except KeyError:
+        return table.iloc[:0].droplevel(['State', 'City'])
+    return daily.loc[start:end]
+
+
+# Resolution to draw [start, end] at: the finest with at most `max_points` periods in the
+# range, else the coarsest
+def trend_resolution(start, end, max_points):
+    for resolution, freq in TREND_RESOLUTIONS.items():
+        if len(pd.period_range(start, end, freq=freq)) <= max_points:
+            break
+    return resolution
+
+
+# Rows of the trend pyramid for `level` whose periods overlap [start, end] (the whole
+# dataset by default), at `resolution` or at the finest one fitting `max_points` periods
+# (default: the point budget of a chart). `groups` selects States, or (State, City) pairs
+# at the City level. Returns the table and its resolution.
+def trend_table(cube, level='all', groups=None, start=None, end=None, max_points=None, resolution=None):
+    dates = cube['daily'].index
+    start = pd.Timestamp(dates.min() if start is None else start)
+    end = pd.Timestamp(dates.max() if end is None else end)
+    if resolution is None:
+        resolution = trend_resolution(start, end, point_budget() if max_points is None else max_points)
+    # Cubes without the pyramid query it on demand (sql_backend.SqlCube)
+    if 'pyramid' not in cube:
+        table = cube.trend_table(level, resolution, groups)
+    else:
+        table = cube['pyramid'][(level, resolution)]
+        if groups is not None:
+            table = table[table.index.droplevel('Date Local').isin(list(groups))]
+    first, last = period_end([start, end], resolution)
+    periods = table.index.get_level_values('Date Local')
+    return table[(periods >= first) & (periods <= last)], resolution
@@ -0,0 +1,85 @@
+import os
+from collections import namedtuple
+
+from aggregates import (TREND_RESOLUTIONS, build_cube, city_daily, daily_means, load_cube, monthly_means, state_means,
+                        trend_table)
+from data_index import LocationIndex, load_index
+from data_preprocessing import DASHBOARD_COLUMNS, POLLUTANT_AQI_COLUMNS, compact, load_data, memory_report, read_raw_csv
+from outliers import detect_outliers_iqr, iqr_bounds, replace_outliers_with_median
+from parallel import preprocess_parallel
+from pipeline import collapse_site_days, dataset_version, impute_medians, load_clean_data, preprocess
+from profiling import span
+from sql_backend import load_sql
+from streaming import CLEAN_DATA_PATH
+
+# Library API behind the dashboards. Every step the pages run (loading, imputation,
+# outlier handling, filtering and aggregation) is importable from here without
+# Streamlit, so it can be scripted, timed (see benchmarks/) and regression-tested.
+__all__ = [
+    'BACKENDS', 'DashboardData', 'LocationIndex', 'TREND_RESOLUTIONS', 'build_cube', 'city_daily',
+    'collapse_site_days', 'compact', 'daily_means', 'daily_trend', 'dataset_version', 'detect_outliers_iqr',
+    'impute_medians', 'iqr_bounds', 'load_clean_data', 'load_cube', 'load_dashboard', 'load_data', 'load_index',
+    'measure_trend', 'memory_report', 'monthly_means', 'monthly_trend', 'preprocess', 'preprocess_parallel',
+    'read_raw_csv', 'replace_outliers_with_median', 'state_means', 'state_ranking', 'state_trends', 'top_states',
+    'trend_table',
+]
+
+# Everything a dashboard page reads, all shared between sessions and read-only
+DashboardData = namedtuple('DashboardData', ['data', 'cube', 'index', 'version'])
+
+BACKENDS = ('pandas', 'sql')
+# 'pandas' holds the cleaned frame in memory; 'sql' queries the cleaned parquet file
+# written by `ingest.py --clean` with DuckDB and only holds aggregates (see sql_backend.py)
+DEFAULT_BACKEND = os.environ.get('POLLUTION_BACKEND', 'pandas')
+
+
+# Cleaned data, aggregate cube, location index and dataset version, each built once per dataset version.
+# `workers` > 1 cleans the data over that many processes when it is not cached yet.
+# With the 'sql' backend, `source` is the cleaned parquet data and `data` only a preview of it.
+def load_dashboard(source=None, columns=DASHBOARD_COLUMNS, workers=None, backend=None):
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+    with span('load_dashboard'):
+        if backend == 'sql':
+            return DashboardData(*load_sql(source or CLEAN_DATA_PATH))
+        return DashboardData(
+            data=load_clean_data(source, columns, workers=workers),
+            cube=load_cube(source, columns),
+            index=load_index(source, columns),
+            version=dataset_version(source, columns),
+        )
+
+
+# Mean of one measure across all sites, per day within [start, end]
+def daily_trend(cube, measure, start=None, end=None):
+    return daily_means(cube, [measure], start, end)[measure]
+
+
+# Mean of one measure across all sites, per month overlapping [start, end]
+def monthly_trend(cube, measure, start=None, end=None):
+    return trend_table(cube, start=start, end=end, resolution='month')[0][measure]
+
+
+# Mean of one measure across all sites per period overlapping [start, end], at the finest
+# resolution (day, week, month or year) that fits in `max_points` points
+def measure_trend(cube, measure, start=None, end=None, max_points=None):
+    return trend_table(cube, start=start, end=end, max_points=max_points)[0][measure]
+
+
+# States with the highest median AQI, ordered by each pollutant in turn
+def top_states(cube, n=10, measures=POLLUTANT_AQI_COLUMNS):
+    return cube['state_median'].sort_values(by=list(measures), ascending=False)[:n]
+
+
+# Mean of one measure per State, highest first
+def state_ranking(cube, measure):
+    return state_means(cube, [measure]).sort_values(by=measure, ascending=False)
+
+
+# Mean of one measure per selected State and period, smoothed with a rolling mean over
+# aggregates.TREND_WINDOW periods, in long format (State, Date Local, measure,
+# '<measure>_Rolling'), at the finest resolution that fits in `max_points` points per State
+def state_trends(cube, states, measure, start=None, end=None, max_points=None):
+    table, _ = trend_table(cube, 'State', states, start, end, max_points)
+    return table[[measure, f'{measure}_Rolling']].reset_index()
@@ -0,0 +1,163 @@
+import argparse
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+try:
+    import psutil
+except ImportError:  # memory is left out of the report without psutil
+    psutil = None
+
+# Concurrent dashboard sessions, each a Streamlit AppTest running a page from the
+# current directory (the dataset the page loads is the one `streamlit run` would load
+# there) and changing its sidebar widgets at random, one rerun per change. Sessions run
+# as threads of one process, as a Streamlit server runs them, or spread over several
+# processes standing in for server replicas. The report gives the rerun latencies and
+# the memory of every process, where sessions sharing one copy of the dataset show up
+# as memory that does not grow with the number of sessions.
+DEFAULT_PAGE = 'main.py'
+DEFAULT_SESSIONS = 8
+DEFAULT_RERUNS = 10
+# Time allowed for a single run of the page, the first one loading the dataset
+RUN_TIMEOUT = 600
+
+
+# (rss, pss) of this process in bytes; pss counts the pages shared with other processes
+# (the mapped dataset) once over all of them, where the platform reports it
+def _memory():
+    if psutil is None:
+        return None, None
+    process = psutil.Process()
+    try:
+        return process.memory_info().rss, getattr(process.memory_full_info(), 'pss', None)
+    except psutil.AccessDenied:
+        return process.memory_info().rss, None
+
+
+# Change one sidebar widget of `app` at random: pollutant, State, city or start date,
+# the start date between `first_date` and 30 days before the end date
+def _change_widget(app, rng, first_date):
+    selectboxes = app.sidebar.selectbox
+    choices = [box for box in selectboxes if len(box.options) > 1]
+    dates = app.sidebar.date_input
+    if len(dates) == 2 and (not choices or rng.random() < 0.25):
+        days = (dates[1].value - first_date).days
+        if days > 30:
+            dates[0].set_value(first_date + datetime.timedelta(days=rng.randrange(days - 30)))
+            return 'start date'
+    if choices:
+        box = rng.choice(choices)
+        box.select(rng.choice([option for option in box.options if option != box.value] or box.options))
+        return box.label
+    return None
+
+
+# Run one session: the first run of the page, then `reruns` widget changes. Returns
+# (first run seconds, [rerun seconds], [errors]).
+def run_session(page, reruns, seed):
+    rng = random.Random(seed)
+    app = AppTest.from_file(os.path.abspath(page), default_timeout=RUN_TIMEOUT)
+    start = time.perf_counter()
+    app.run()
+    first = time.perf_counter() - start
+    errors = [exception.message for exception in app.exception]
+    # The start date input opens on the first date of the data
+    first_date = app.sidebar.date_input[0].value if app.sidebar.date_input else None
+    latencies = []
+    for _ in range(reruns):
+        change = _change_widget(app, rng, first_date)
+        start = time.perf_counter()
+        app.run()
+        latencies.append(time.perf_counter() - start)
+        errors += [f"after changing {change}: {exception.message}" for exception in app.exception]
+    return first, latencies, errors
+
+
+# Run `sessions` sessions concurrently in threads of this process, returning their
+# results and the memory of the process once they are done
+def run_sessions(page, sessions, reruns, seed=0):
+    results = [None] * sessions
+
+    def session(i):
+        try:
+            results[i] = run_session(page, reruns, seed + i)
+        except Exception as error:
+            results[i] = (None, [], [f"{type(error).__name__}: {error}"])
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, _memory()
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else float('nan')
+
+
+# `sessions` sessions over `processes` processes (0 runs them in this process).
+# Returns a dict of the latencies, errors and memory of the run.
+def load_test(page=DEFAULT_PAGE, sessions=DEFAULT_SESSIONS, reruns=DEFAULT_RERUNS, processes=0, seed=0):
+    start = time.perf_counter()
+    if processes:
+        shares = [len(range(i, sessions, processes)) for i in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            runs = list(pool.map(run_sessions, [page] * processes, shares, [reruns] * processes,
+                                 [seed + sum(shares[:i]) for i in range(processes)]))
+    else:
+        runs = [run_sessions(page, sessions, reruns, seed)]
+    seconds = time.perf_counter() - start
+
+    results = [result for session_results, _ in runs for result in session_results]
+    first = [result[0] for result in results if result[0] is not None]
+    latencies = [latency for result in results for latency in result[1]]
+    rss = [memory[0] for _, memory in runs]
+    pss = [memory[1] for _, memory in runs]
+    return {
+        'page': page, 'sessions': sessions, 'processes': processes or 1, 'reruns': len(latencies), 'seconds': seconds,
+        'first_run_p50': _percentile(first, 50), 'first_run_max': max(first, default=float('nan')),
+        'rerun_p50': _percentile(latencies, 50), 'rerun_p95': _percentile(latencies, 95),
+        'rss_bytes': sum(rss) if None not in rss else None,
+        'pss_bytes': sum(pss) if None not in pss else None,
+        'errors': [error for result in results for error in result[2]],
+    }
+
+
+def _megabytes(value):
+    return 'n/a' if value is None else f"{value / 2 ** 20:.0f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent dashboard sessions changing sidebar widgets and "
+                                                 "report rerun latency and memory.")
+    parser.add_argument('--page', default=DEFAULT_PAGE, help=f"page to run, from the current directory (default {DEFAULT_PAGE})")
+    parser.add_argument('--sessions', type=int, default=DEFAULT_SESSIONS, help="concurrent sessions")
+    parser.add_argument('--reruns', type=int, default=DEFAULT_RERUNS, help="widget changes per session")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="spread the sessions over this many processes (default: all in this one)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the widget changes")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.page):
+        parser.error(f"no page {args.page!r} in {os.getcwd()}")
+    report = load_test(args.page, args.sessions, args.reruns, args.processes, args.seed)
+    print(f"{report['sessions']} sessions of {report['page']} over {report['processes']} process(es), "
+          f"{report['reruns']} reruns in {report['seconds']:.1f}s")
+    print(f"first run  p50 {report['first_run_p50']:.3f}s  max {report['first_run_max']:.3f}s")
+    print(f"rerun      p50 {report['rerun_p50']:.3f}s  p95 {report['rerun_p95']:.3f}s")
+    print(f"memory     rss {_megabytes(report['rss_bytes'])}  pss {_megabytes(report['pss_bytes'])}")
+    for error in report['errors']:
+        print(f"ERROR {error}")
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+import analytics
+from benchmarks.synthetic import parse_rows, synthetic_dataset
+from data_preprocessing import POLLUTANT_AQI_COLUMNS, POLLUTANT_MEAN_COLUMNS
+
+DEFAULT_SIZES = ['100k', '1M', '10M']
+# A stage slower (or with a higher peak) than the baseline by more than this fraction is a regression
+DEFAULT_TOLERANCE = 0.25
+# Stages faster than this are too noisy to compare against a baseline
+MIN_COMPARABLE_SECONDS = 0.05
+
+
+# Run `function()` once, returning its result with wall time and peak traced memory
+def measure(function, trace_memory=True):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+# Time and profile every stage of the dashboard pipeline on `path`, in the order the
+# dashboards run them, each stage on the previous stage's output
+def run_stages(path, trace_memory=True):
+    results = []
+
+    def stage(name, function):
+        result, seconds, peak = measure(function, trace_memory)
+        results.append({'stage': name, 'seconds': seconds, 'peak_bytes': peak})
+        return result
+
+    raw = stage('load', lambda: analytics.read_raw_csv(path))
+    # The whole pipeline over one process per CPU, for comparison with the serial stages below
+    stage('preprocess_parallel', lambda: analytics.preprocess_parallel(raw))
+    data, _ = stage('collapse_site_days', lambda: analytics.collapse_site_days(raw))
+    data, _ = stage('impute', lambda: analytics.impute_medians(data))
+    data = stage('drop_bad_dates', lambda: data.dropna(subset=['Date Local']))
+    stage('detect_outliers', lambda: analytics.detect_outliers_iqr(data, POLLUTANT_AQI_COLUMNS))
+    data = stage('replace_outliers', lambda: analytics.replace_outliers_with_median(data, POLLUTANT_AQI_COLUMNS))
+    data = stage('sort', lambda: data.sort_values(['State', 'City', 'Date Local'], kind='stable', ignore_index=True))
+    data = stage('compact', lambda: analytics.compact(data))
+    cube = stage('build_cube', lambda: analytics.build_cube(data))
+    index = stage('build_index', lambda: analytics.LocationIndex(data))
+
+    states = index.states()[:5]
+    state = states[0]
+    city = index.cities(state)[0]
+    start, end = index.min_date, index.min_date + pd.Timedelta(days=3 * 365)
+    stage('filter_states', lambda: index.states(start, end))
+    stage('filter_rows', lambda: index.rows_for_states(states, start, end))
+    stage('filter_city', lambda: index.city_rows(state, city, start, end))
+    stage('state_trends', lambda: analytics.state_trends(cube, states, 'NO2 AQI'))
+    stage('state_means', lambda: analytics.state_means(cube, POLLUTANT_AQI_COLUMNS))
+    stage('monthly_means', lambda: analytics.monthly_means(cube, POLLUTANT_AQI_COLUMNS))
+    stage('monthly_trend', lambda: analytics.monthly_trend(cube, POLLUTANT_MEAN_COLUMNS[0], start, end))
+    stage('measure_trend', lambda: analytics.measure_trend(cube, POLLUTANT_MEAN_COLUMNS[0], start, end))
+    stage('city_daily', lambda: analytics.city_daily(cube, state, city, start, end))
+    return results
+
+
+# Stages of `results` slower or hungrier than in `baseline` by more than `tolerance`
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    previous = {(entry['rows'], entry['stage']): entry for entry in baseline['results']}
+    found = []
+    for entry in results:
+        before = previous.get((entry['rows'], entry['stage']))
+        if before is None:
+            continue
+        if before['seconds'] >= MIN_COMPARABLE_SECONDS and entry['seconds'] > before['seconds'] * (1 + tolerance):
+            found.append((entry, 'seconds', before['seconds']))
+        if before['peak_bytes'] and entry['peak_bytes'] and entry['peak_bytes'] > before['peak_bytes'] * (1 + tolerance):
+            found.append((entry, 'peak_bytes', before['peak_bytes']))
+    return found
+
+
+def _report(results):
+    table = pd.DataFrame(results)
+    table['peak_mb'] = table['peak_bytes'] / 2 ** 20
+    return table.pivot(index='stage', columns='rows', values=['seconds', 'peak_mb']).reindex(
+        list(dict.fromkeys(table['stage']))).round(3).to_string()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time and memory-profile each dashboard stage on synthetic data.")
+    parser.add_argument('--rows', nargs='+', default=DEFAULT_SIZES, help="dataset sizes, e.g. 100k 1M 10M")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument('--no-memory', action='store_true', help="skip memory tracing, which slows allocations a little")
+    parser.add_argument('--output', help="write the results as JSON, to serve as a later --baseline")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown or memory growth per stage, as a fraction (default 0.25)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.rows:
+        rows = parse_rows(size)
+        path = synthetic_dataset(rows, args.seed)
+        print(f"{rows} rows ({path})", file=sys.stderr)
+        for entry in run_stages(path, trace_memory=not args.no_memory):
+            results.append({'rows': rows, **entry})
+    print(_report(results))
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'python': platform.python_version(), 'pandas': pd.__version__, 'results': results}, handle, indent=1)
+    if args.baseline:
+        with open(args.baseline) as handle:
+            found = regressions(results, json.load(handle), args.tolerance)
+        for entry, metric, before in found:
+            print(f"REGRESSION {entry['stage']} at {entry['rows']} rows: {metric} {before:.4g} -> {entry[metric]:.4g}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import argparse
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import POLLUTANTS
+
+# Synthetic data in the layout of the EPA export (pollution_us_2000_2016.csv): one
+# unnamed index column, site and location columns, and Units / Mean / 1st Max Value /
+# 1st Max Hour / AQI per pollutant. Like the real file, every site-day appears as four
+# rows that only differ in their SO2 and CO columns, half of them without SO2 AQI and
+# half without CO AQI, and a small share of AQI values are far outliers.
+START_DATE = '2000-01-01'
+DAYS = 6210  # 2000-01-01 to 2016-12-31
+ROWS_PER_SITE_DAY = 4
+OUTLIER_RATE = 0.01
+
+STATES = [
+    'Arizona', 'California', 'Colorado', 'District Of Columbia', 'Florida', 'Illinois', 'Kansas',
+    'Louisiana', 'Massachusetts', 'Michigan', 'New York', 'North Carolina', 'Ohio', 'Oklahoma',
+    'Pennsylvania', 'Texas', 'Virginia', 'Washington', 'Wisconsin', 'Wyoming',
+]
+UNITS = {'NO2': 'Parts per billion', 'O3': 'Parts per million', 'SO2': 'Parts per billion', 'CO': 'Parts per million'}
+# Typical daily mean of each pollutant in its unit
+SCALES = {'NO2': 12.0, 'O3': 0.026, 'SO2': 1.9, 'CO': 0.37}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+# Parse a row count such as 100k, 1M or 2500000
+def parse_rows(text):
+    text = str(text).strip().lower()
+    multiplier = {'k': 10 ** 3, 'm': 10 ** 6}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+# Enough sites that each one covers at most the full 2000-2016 period
+def site_count(rows):
+    return max(20, math.ceil(rows / ROWS_PER_SITE_DAY / DAYS))
+
+
+def _sites(count):
+    site = np.arange(count)
+    state = site % len(STATES)
+    # Every seventh site has no city, as in the EPA file
+    city = np.where(site % 7 == 0, 'Not in a city', [f'{STATES[s]} City {c}' for s, c in zip(state, site % 11)])
+    return pd.DataFrame({
+        'State Code': state + 1,
+        'County Code': site % 5 + 1,
+        'Site Num': site,
+        'Address': [f'{number} Main Street' for number in site],
+        'State': np.asarray(STATES)[state],
+        'County': [f'{STATES[s]} County {c}' for s, c in zip(state, site % 5)],
+        'City': city,
+    })
+
+
+# Rows of `sites` for `days` consecutive days each, four rows per site-day
+def _site_days(rng, sites, days):
+    frame = sites.loc[sites.index.repeat(days)].reset_index(drop=True)
+    day = np.tile(np.arange(days), len(sites))
+    frame.insert(len(frame.columns), 'Date Local', (pd.Timestamp(START_DATE) + pd.to_timedelta(day, unit='D')).strftime('%Y-%m-%d'))
+    # Seasonal cycle shared by all pollutants, strongest in summer
+    season = 1 + 0.3 * np.sin(2 * np.pi * (day % 365) / 365)
+    for pollutant in POLLUTANTS:
+        mean = rng.gamma(2.0, SCALES[pollutant] / 2, len(frame)) * season
+        aqi = np.rint(np.clip(mean / SCALES[pollutant] * 20 + rng.normal(0, 4, len(frame)), 0, None))
+        outliers = rng.random(len(frame)) < OUTLIER_RATE
+        aqi[outliers] = rng.integers(150, 300, outliers.sum())
+        frame[f'{pollutant} Units'] = UNITS[pollutant]
+        frame[f'{pollutant} Mean'] = mean.round(6)
+        frame[f'{pollutant} 1st Max Value'] = (mean * (1 + rng.gamma(2.0, 0.4, len(frame)))).round(3)
+        frame[f'{pollutant} 1st Max Hour'] = rng.integers(0, 24, len(frame))
+        frame[f'{pollutant} AQI'] = aqi
+
+    rows = frame.loc[frame.index.repeat(ROWS_PER_SITE_DAY)].reset_index(drop=True)
+    copy = np.tile(np.arange(ROWS_PER_SITE_DAY), len(frame))
+    # The duplicate rows carry other SO2 / CO samples of the day, without their AQI
+    for pollutant, missing in [('SO2', copy % 2 == 1), ('CO', copy >= 2)]:
+        rows.loc[missing, f'{pollutant} AQI'] = np.nan
+        rows.loc[copy > 0, f'{pollutant} Mean'] = (rows.loc[copy > 0, f'{pollutant} Mean']
+                                                   * rng.uniform(0.8, 1.2, (copy > 0).sum())).round(6)
+    return rows
+
+
+# Write `rows` rows of synthetic EPA data to `path`, a few sites at a time so memory
+# stays bounded whatever the size. The same rows and seed always give the same file.
+def generate(rows, path, seed=0):
+    rng = np.random.default_rng(seed)
+    sites = _sites(site_count(rows))
+    days = math.ceil(rows / ROWS_PER_SITE_DAY / len(sites))
+    sites_per_chunk = max(1, 250_000 // (days * ROWS_PER_SITE_DAY))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    written = 0
+    with open(path, 'w', newline='') as handle:
+        for first in range(0, len(sites), sites_per_chunk):
+            chunk = _site_days(rng, sites.iloc[first:first + sites_per_chunk], days).iloc[:rows - written]
+            chunk.insert(0, 'Unnamed: 0', np.arange(written, written + len(chunk)))
+            chunk.to_csv(handle, index=False, header=written == 0)
+            written += len(chunk)
+            if written >= rows:
+                break
+    return path
+
+
+# Path of the synthetic file with `rows` rows, generated on first use
+def synthetic_dataset(rows, seed=0, data_dir=DATA_DIR):
+    path = os.path.join(data_dir, f'pollution_synthetic_{rows}_{seed}.csv')
+    if not os.path.exists(path):
+        generate(rows, path + '.tmp', seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic data in the EPA pollution CSV layout.")
+    parser.add_argument('rows', help="number of rows, e.g. 100k, 1M or 10M")
+    parser.add_argument('--out', help="output CSV (default benchmarks/data/pollution_synthetic_<rows>_<seed>.csv)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    rows = parse_rows(args.rows)
+    path = generate(rows, args.out, args.seed) if args.out else synthetic_dataset(rows, args.seed)
+    print(f"Wrote {rows} rows to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import contextlib
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # no lock between processes (Windows); each still writes its own temporary file
+    fcntl = None
+
+CACHE_DIR = ".cache"
+
+# Artifacts kept in memory for the life of the process, shared by every Streamlit session
+_memory = {}
+_fingerprints = {}
+_lock = threading.RLock()
+
+
+# Cheap signature of a file or directory tree, used to avoid re-hashing unchanged inputs
+def _stat_signature(path):
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(glob.glob(os.path.join(path, '**', '*'), recursive=True))
+    signature = []
+    for name in files:
+        if os.path.isfile(name):
+            stat = os.stat(name)
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+# Content hash of a file or of every file below a directory
+def fingerprint(path):
+    signature = _stat_signature(path)
+    known = _fingerprints.get(path)
+    if known is not None and known[0] == signature:
+        return known[1]
+
+    digest = hashlib.sha256()
+    for name, _, _ in signature:
+        digest.update(os.path.relpath(name, path).encode())
+        with open(name, 'rb') as handle:
+            for block in iter(lambda: handle.read(1 << 20), b''):
+                digest.update(block)
+    _fingerprints[path] = (signature, digest.hexdigest())
+    return digest.hexdigest()
+
+
+# Combine any number of strings into a short cache key
+def make_key(*parts):
+    return hashlib.sha256('\0'.join(str(part) for part in parts).encode()).hexdigest()[:16]
+
+
+# Name of an artifact built from one selection of columns. Versions of an artifact replace
+# each other only within a name, so pages loading different columns keep their own copies.
+def artifact_name(name, columns):
+    return f"{name}-{make_key(columns)[:8]}"
+
+
+# Hold an exclusive lock on artifact `name` in `cache_dir`, shared by every process using
+# the directory, so that processes starting with a cold cache build the artifact once and
+# never remove or replace a file another one is writing or about to read
+@contextlib.contextmanager
+def _disk_lock(cache_dir, name):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{name}.lock"), 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+
+# Write `path` through write(temporary path) then a rename, so a crash never leaves a
+# truncated file behind; the temporary file is unique to the writer
+def _write_atomic(path, write):
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix='.tmp')
+    os.close(handle)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _remove_stale(cache_dir, name, extension):
+    for stale in glob.glob(os.path.join(cache_dir, f"{name}-*.{extension}")):
+        os.remove(stale)
+
+
+# Return the artifact `name` for `key`, from memory, then disk, else by calling `build()`.
+# Older versions of the same artifact are dropped from both tiers when a new key is built.
+# With persist=False the artifact only lives in memory, for things cheaper to rebuild than to load.
+def cached_artifact(name, key, build, cache_dir=CACHE_DIR, persist=True):
+    with _lock:
+        if (name, key) in _memory:
+            return _memory[(name, key)]
+
+        path = os.path.join(cache_dir, f"{name}-{key}.pkl")
+        if not persist:
+            artifact = build()
+        else:
+            with _disk_lock(cache_dir, name):
+                # Checked under the lock: another process may have built it meanwhile
+                if os.path.exists(path):
+                    artifact = pd.read_pickle(path)
+                else:
+                    artifact = build()
+                    _remove_stale(cache_dir, name, 'pkl')
+                    _write_atomic(path, lambda target: pd.to_pickle(artifact, target))
+
+        for stale in [cached for cached in _memory if cached[0] == name]:
+            del _memory[stale]
+        _memory[(name, key)] = artifact
+        return artifact
+
+
+# Arrow column of a DataFrame column. Numeric and datetime columns keep their NaN/NaT as
+# values rather than nulls, so reading them back needs no validity bitmap and no copy.
+def _arrow_column(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        return pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), pa.array(values.cat.categories.to_numpy()))
+    if values.dtype.kind in 'biufM':
+        return pa.array(values.to_numpy())
+    return pa.array(values, from_pandas=True)
+
+
+# Write a DataFrame as an uncompressed Arrow IPC file, which map_frame() reads without copying
+def write_frame(data, path):
+    table = pa.table({column: _arrow_column(data[column]) for column in data.columns})
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+# DataFrame over a memory-mapped Arrow IPC file. Numeric and datetime columns are views of
+# the mapped pages (read-only), so every process mapping the file shares one copy of them
+# in the page cache, and pages are only read from disk when a column is first touched.
+def map_frame(path):
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+# cached_artifact() for a DataFrame shared read-only by every session and process: the
+# disk tier is an Arrow file mapped into memory instead of a pickle loaded into it
+def cached_frame(name, key, build, cache_dir=CACHE_DIR):
+    with _lock:
+        if (name, key) in _memory:
+            return _memory[(name, key)]
+
+        path = os.path.join(cache_dir, f"{name}-{key}.arrow")
+        with _disk_lock(cache_dir, name):
+            # Checked under the lock: another process may have built it meanwhile
+            if not os.path.exists(path):
+                data = build()
+                # Processes still mapping a removed file keep reading it until they reload
+                _remove_stale(cache_dir, name, 'arrow')
+                _write_atomic(path, lambda target: write_frame(data, target))
+                del data
+            frame = map_frame(path)
+
+        for stale in [cached for cached in _memory if cached[0] == name]:
+            del _memory[stale]
+        _memory[(name, key)] = frame
+        return frame
@@ -0,0 +1,215 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import plotly.express as px
+import seaborn as sns
+
+from analytics import (city_daily, daily_trend, measure_trend, monthly_means, state_means, state_ranking, state_trends,
+                       top_states)
+from data_preprocessing import POLLUTANT_AQI_COLUMNS
+from downsampling import CHART_WIDTH_PX, downsample, point_budget
+
+# The dashboard panels as figures, from the aggregate cube and the location index only.
+# The pages show them through visualization.show_pyplot / show_plotly, and report.py
+# renders them to files without a Streamlit server. Functions returning a matplotlib
+# figure leave closing it to the caller (visualization.figure_png does).
+
+
+# Mean of a pollutant over the date range, per day, week, month or year: the finest
+# resolution of the trend pyramid that fits the chart's point budget (main.py)
+def trend_figure(cube, pollutant, start, end):
+    data_grouped = measure_trend(cube, pollutant, start, end, point_budget())
+    fig, ax = plt.subplots(figsize=(10, 6))
+    data_grouped.plot(ax=ax, color='tab:blue', lw=2)
+    ax.set_title(f"{pollutant} Levels Over Time", fontsize=16, color='darkorange')
+    ax.set_xlabel("Date", fontsize=12, color='darkgreen')
+    ax.set_ylabel("Pollutant Level", fontsize=12, color='darkgreen')
+    ax.grid(True)
+    ax.set_xticks(data_grouped.index[::max(len(data_grouped) // 6, 1)])
+    ax.set_xticklabels(data_grouped.index.strftime('%Y-%m-%d')[::max(len(data_grouped) // 6, 1)], rotation=45)
+    return fig
+
+
+# Daily mean of a pollutant over the date range (new.py)
+def daily_trend_figure(cube, pollutant, start, end):
+    # One point per day over the whole period: keep the envelope of the daily means
+    data_grouped = downsample(daily_trend(cube, pollutant, start, end), point_budget(mode='minmax'), 'minmax')
+    fig, ax = plt.subplots(figsize=(10, 6))
+    data_grouped.plot(ax=ax, color='tab:blue', lw=2)
+    ax.set_title(f"{pollutant} Levels Over Time", fontsize=16, color='darkorange')
+    ax.set_xlabel("Date", fontsize=12, color='darkgreen')
+    ax.set_ylabel("Pollutant Level", fontsize=12, color='darkgreen')
+    ax.grid(True)
+    return fig
+
+
+def top_states_figure(cube):
+    fig, ax = plt.subplots()
+    top_states(cube, 10).plot(kind="bar", ax=ax)
+    return fig
+
+
+# AQI levels and peak values of a city, side by side (main.py)
+def city_figure(cube, state, city, start, end):
+    # Daily medians for the selected city, read from the precomputed City x Date table
+    city_data = city_daily(cube, state, city, start, end)
+    # Each of the side-by-side axes gets half the chart width; the peak values keep their extremes
+    aqi_data = downsample(city_data[['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']], point_budget(CHART_WIDTH_PX / 2, 'lttb'), 'lttb')
+    max_data = downsample(city_data[['NO2 1st Max Value', 'O3 1st Max Value', 'SO2 1st Max Value', 'CO 1st Max Value']],
+                          point_budget(CHART_WIDTH_PX / 2, 'minmax'), 'minmax')
+    fig, axs = plt.subplots(1, 2, figsize=(15,5))
+
+    # AQI Line Chart
+    aqi_data.plot(kind="line", ax=axs[0])
+    axs[0].set_title("AQI Levels by Pollutant")
+    axs[0].set_xlabel("Date")
+    axs[0].set_ylabel("AQI Level")
+
+    # Max Value Line Chart
+    max_data.plot(kind="line", ax=axs[1])
+    axs[1].set_title("Peak Pollutant Levels")
+    axs[1].set_xlabel("Date")
+    axs[1].set_ylabel("Pollutant Level")
+    return fig
+
+
+# AQI levels of a city (new.py)
+def city_aqi_figure(cube, state, city, start, end):
+    city_data = city_daily(cube, state, city, start, end)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    # Markers are drawn for every point, so keep at most one per pixel
+    aqi_data = downsample(city_data[['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']], point_budget(), 'lttb')
+    aqi_data.plot(ax=ax, title=f"AQI Levels in {city}", marker='o', colormap='coolwarm')
+    ax.set_ylabel("AQI Level")
+    ax.grid(True)
+    return fig
+
+
+def correlation_figure(cube):
+    correlation_data = cube['correlation']
+    fig, ax = plt.subplots(figsize=(8, 6))
+    sns.heatmap(correlation_data, annot=True, cmap='coolwarm', ax=ax, linewidths=0.5)
+    ax.set_title("Correlation Heatmap", fontsize=16)
+    return fig
+
+
+def seasonal_figure(cube):
+    seasonal_data = monthly_means(cube, ['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI'])
+    fig, ax = plt.subplots(figsize=(10, 6))
+    seasonal_data.plot(ax=ax, colormap='coolwarm', marker='o')
+    ax.set_title("Average Pollutant Levels by Month", fontsize=16)
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Pollutant AQI")
+    return fig
+
+
+# Mean of one AQI per State as a heatmap column, highest first (main.py)
+def state_heatmap_figure(cube, pollutant):
+    state_pollutant_pivot = state_ranking(cube, pollutant)
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sns.heatmap(
+        state_pollutant_pivot,
+        cmap="YlGnBu",
+        annot=True,
+        fmt=".1f",
+        ax=ax
+    )
+    ax.set_title(f"Heatmap of {pollutant} Levels Across States")
+    return fig
+
+
+def top_states_bar_figure(cube, pollutant):
+    top_states = state_means(cube, [pollutant]).reset_index().nlargest(10, pollutant)
+
+    return px.bar(
+        top_states,
+        x=pollutant,
+        y='State',
+        orientation='h',
+        title=f"Top 10 States with Highest {pollutant} Levels",
+        labels={pollutant: f'{pollutant} Level'},
+        color=pollutant,
+        color_continuous_scale='Inferno'
+    )
+
+
+# Average levels by state
+def state_bar_figure(cube, pollutant):
+    return px.bar(
+        state_means(cube, [pollutant]).reset_index(),
+        x='State',
+        y=pollutant,
+        title=f"Average {pollutant} Levels by State",
+        labels={'State': 'State', pollutant: f'{pollutant} Level'},
+        color=pollutant,
+        color_continuous_scale='Viridis'
+    )
+
+
+# Averages per State, smoothed with a rolling average, at the finest resolution of the
+# trend pyramid that fits the chart's point budget per State line
+def state_trends_figure(cube, states, pollutant):
+    resampled_data = state_trends(cube, states, pollutant, max_points=point_budget())
+
+    # Plot line chart using smoothed data
+    fig_line = px.line(
+        resampled_data,
+        x="Date Local",
+        y=f'{pollutant}_Rolling',  # Use the rolling average
+        color="State",
+        title=f"Trends of {pollutant} Levels in Selected States (Smoothed)",
+        labels={"Date Local": "Date", f'{pollutant}_Rolling': f"{pollutant} Level"},
+        line_shape="spline"  # Smooth the lines with a spline
+    )
+
+    fig_line.update_layout(
+        xaxis_title="Date",
+        yaxis_title=f"{pollutant} Level",
+        legend_title="State",
+        template="plotly_white",
+        showlegend=True,
+    )
+    return fig_line
+
+
+# Choropleth of the mean of a pollutant per State (new.py)
+def state_map_figure(cube, pollutant):
+    pollutant_state_data = state_means(cube, [pollutant]).reset_index()
+    return px.choropleth(
+        pollutant_state_data,
+        locations="State",
+        locationmode="USA-states",
+        color=pollutant,
+        color_continuous_scale="Viridis",
+        scope="usa",
+        title=f"Average {pollutant} Levels by State"
+    )
+
+
+def aqi_heatmap_figure(cube):
+    avg_aqi_data = state_means(cube, POLLUTANT_AQI_COLUMNS)
+    fig, ax = plt.subplots(figsize=(12, 8))
+    sns.heatmap(
+        avg_aqi_data.transpose(),
+        annot=True,
+        fmt=".1f",
+        cmap="YlGnBu",
+        linewidths=0.5,
+        cbar_kws={'label': 'AQI Levels'},
+        ax=ax
+    )
+    ax.set_title("Heatmap of Average AQI Levels by State and Pollutant", fontsize=16)
+    ax.set_xlabel("States", fontsize=12)
+    ax.set_ylabel("Pollutants", fontsize=12)
+    return fig
+
+
+def aqi_bar_figure(cube):
+    avg_aqi_overall = state_means(cube, POLLUTANT_AQI_COLUMNS).mean()
+    fig, ax = plt.subplots(figsize=(8, 6))
+    avg_aqi_overall.plot(kind='bar', color='skyblue', ax=ax)
+    ax.set_title("Average AQI Levels by Pollutant", fontsize=16)
+    ax.set_ylabel("AQI Level", fontsize=12)
+    ax.set_xticklabels(avg_aqi_overall.index, rotation=45, fontsize=10)
+    return fig
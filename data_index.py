@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from cache import artifact_name, cached_artifact, make_key
+from pipeline import code_fingerprint, dataset_version, load_clean_data
+from profiling import span
+
+INDEX_MODULES = ['data_index.py']
+
+
+def _as_datetime64(value):
+    return None if value is None else pd.Timestamp(value).to_datetime64()
+
+
+# Row offsets of every State and (State, City) block of a frame sorted by
+# (State, City, Date Local). A State or City selection is a dictionary lookup and
+# a date range is a binary search inside each block, so a selection costs time
+# proportional to the rows it returns rather than to the whole dataset.
+class LocationIndex:
+    def __init__(self, data):
+        self.data = data
+        self.dates = data['Date Local'].to_numpy()
+
+        state_codes = pd.factorize(data['State'])[0]
+        city_codes = pd.factorize(data['City'])[0]
+        changes = np.flatnonzero((np.diff(state_codes) != 0) | (np.diff(city_codes) != 0)) + 1
+        starts = np.concatenate([[0], changes]) if len(data) else np.array([], dtype='int64')
+        stops = np.concatenate([changes, [len(data)]]) if len(data) else np.array([], dtype='int64')
+
+        self.state_blocks = {}
+        self.city_blocks = {}
+        self.state_cities = {}
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            state, city = data['State'].iat[start], data['City'].iat[start]
+            first, _ = self.state_blocks.get(state, (start, stop))
+            self.state_blocks[state] = (first, stop)
+            cities = self.state_cities.setdefault(state, [])
+            # Rows without a City belong to their State block but have no City entry
+            if not pd.isna(city):
+                self.city_blocks[(state, city)] = (start, stop)
+                cities.append(city)
+
+        self.min_date = self.dates.min() if len(data) else None
+        self.max_date = self.dates.max() if len(data) else None
+
+    # Sub-range of a City block whose dates fall in [begin, end]
+    def _clip(self, start, stop, begin=None, end=None):
+        dates = self.dates[start:stop]
+        low = dates.searchsorted(begin, 'left') if begin is not None else 0
+        high = dates.searchsorted(end, 'right') if end is not None else len(dates)
+        return start + low, start + max(low, high)
+
+    def _state_ranges(self, state, begin=None, end=None):
+        if state not in self.state_blocks:
+            return []
+        first, last = self.state_blocks[state]
+        if begin is None and end is None:
+            return [(first, last)]
+        # Dates are only sorted inside a City block, so clip each block of the State
+        bounds = [self.city_blocks[(state, city)] for city in self.state_cities[state]]
+        covered = sum(stop - start for start, stop in bounds)
+        if covered < last - first:
+            # Rows without a City sort last in the State block
+            bounds.append((first + covered, last))
+        return [self._clip(start, stop, begin, end) for start, stop in bounds]
+
+    def _take(self, ranges):
+        ranges = [(start, stop) for start, stop in ranges if stop > start]
+        if len(ranges) == 1:
+            return self.data.iloc[ranges[0][0]:ranges[0][1]]
+        if not ranges:
+            return self.data.iloc[:0]
+        return self.data.iloc[np.concatenate([np.arange(start, stop) for start, stop in ranges])]
+
+    # States with at least one row in the date range
+    def states(self, begin=None, end=None):
+        begin, end = _as_datetime64(begin), _as_datetime64(end)
+        return [state for state in self.state_blocks
+                if any(stop > start for start, stop in self._state_ranges(state, begin, end))]
+
+    # Cities of a State with at least one row in the date range
+    def cities(self, state, begin=None, end=None):
+        begin, end = _as_datetime64(begin), _as_datetime64(end)
+        cities = []
+        for city in self.state_cities.get(state, []):
+            start, stop = self._clip(*self.city_blocks[(state, city)], begin, end)
+            if stop > start:
+                cities.append(city)
+        return cities
+
+    # Up to `limit` cities of a State with the most rows in the date range, largest first
+    def largest_cities(self, state, limit, begin=None, end=None):
+        begin, end = _as_datetime64(begin), _as_datetime64(end)
+        sizes = {}
+        for city in self.state_cities.get(state, []):
+            start, stop = self._clip(*self.city_blocks[(state, city)], begin, end)
+            if stop > start:
+                sizes[city] = stop - start
+        return sorted(sizes, key=lambda city: (-sizes[city], city))[:limit]
+
+    def state_rows(self, state, begin=None, end=None):
+        return self._take(self._state_ranges(state, _as_datetime64(begin), _as_datetime64(end)))
+
+    def city_rows(self, state, city, begin=None, end=None):
+        if (state, city) not in self.city_blocks:
+            return self.data.iloc[:0]
+        return self._take([self._clip(*self.city_blocks[(state, city)], _as_datetime64(begin), _as_datetime64(end))])
+
+    def rows_for_states(self, states, begin=None, end=None):
+        begin, end = _as_datetime64(begin), _as_datetime64(end)
+        return self._take([bounds for state in states for bounds in self._state_ranges(state, begin, end)])
+
+
+# Index over the cleaned dataset, rebuilt in memory once per dataset version
+def load_index(source=None, columns=None):
+    key = make_key(dataset_version(source, columns), code_fingerprint(INDEX_MODULES))
+    with span('location_index'):
+        return cached_artifact(artifact_name('location_index', columns), key,
+                               lambda: LocationIndex(load_clean_data(source, columns)), persist=False)
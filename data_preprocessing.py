@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+# Raw EPA export and the columnar store built from it by ingest.py
+RAW_DATA_PATH = "pollution_us_2000_2016.csv"
+STORE_PATH = "pollution_store"
+# Cleaned dataset grown by `ingest.py --append` (see incremental.py)
+INCREMENTAL_PATH = "pollution_incremental"
+
+POLLUTANTS = ['NO2', 'O3', 'SO2', 'CO']
+POLLUTANT_AQI_COLUMNS = [f'{p} AQI' for p in POLLUTANTS]
+POLLUTANT_MEAN_COLUMNS = [f'{p} Mean' for p in POLLUTANTS]
+POLLUTANT_MAX_COLUMNS = [f'{p} 1st Max Value' for p in POLLUTANTS]
+POLLUTANT_HOUR_COLUMNS = [f'{p} 1st Max Hour' for p in POLLUTANTS]
+
+# Fixed dtypes for the raw file, so nothing is left as untyped text
+CATEGORICAL_COLUMNS = ['State', 'County', 'City', 'Address'] + [f'{p} Units' for p in POLLUTANTS]
+CODE_COLUMNS = ['State Code', 'County Code', 'Site Num']
+MEASURE_COLUMNS = [f'{p} {m}' for p in POLLUTANTS for m in ['Mean', '1st Max Value', '1st Max Hour', 'AQI']]
+# Measures holding whole numbers (an index, an hour of the day): few distinct values
+DISCRETE_COLUMNS = POLLUTANT_AQI_COLUMNS + POLLUTANT_HOUR_COLUMNS
+# Columns identifying a monitoring site
+SITE_COLUMNS = CODE_COLUMNS
+
+RAW_DTYPES = {
+    **{column: 'category' for column in CATEGORICAL_COLUMNS},
+    **{column: 'int32' for column in CODE_COLUMNS},
+    **{column: 'float32' for column in MEASURE_COLUMNS},
+}
+
+# Integer types compact() may narrow a column to, smallest first
+INTEGER_TYPES = ['int8', 'int16', 'int32']
+# Text columns with at most this fraction of distinct values become categoricals
+MAX_CATEGORY_RATIO = 0.5
+
+# Columns the dashboards actually read, and the site columns the cleaning needs
+DASHBOARD_COLUMNS = (SITE_COLUMNS + ['State', 'County', 'City', 'Date Local'] + POLLUTANT_MEAN_COLUMNS
+                     + POLLUTANT_MAX_COLUMNS + POLLUTANT_AQI_COLUMNS)
+
+
+def _usecols(columns):
+    if columns is None:
+        return lambda column: column != 'Unnamed: 0'
+    return list(columns)
+
+
+def _parse_dates(data):
+    if 'Date Local' in data.columns:
+        data['Date Local'] = pd.to_datetime(data['Date Local'], format='%Y-%m-%d', errors='coerce')
+    return data
+
+
+# Categorical location and unit columns with sorted categories. read_csv and parquet
+# keep categories in order of appearance, which would make sorting by them depend on
+# the input order rather than on the labels.
+def _as_categories(data):
+    for column in data.columns.intersection(CATEGORICAL_COLUMNS):
+        if data[column].dtype != 'category':
+            data[column] = data[column].astype('category')
+        categories = data[column].cat.categories
+        if not categories.is_monotonic_increasing:
+            data[column] = data[column].cat.reorder_categories(categories.sort_values())
+    return data
+
+
+def _narrowest_integer(values):
+    if len(values) == 0:
+        return None
+    low, high = values.min(), values.max()
+    for dtype in INTEGER_TYPES:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return None
+
+
+# Shrink every column to the smallest dtype that holds all of its values: repeated text
+# as categoricals (without unused categories), integers and whole-number floats without
+# NaN as the narrowest integer type covering their range, and float64 as float32 when no
+# value changes. float16 is never used, pandas computes little natively in it.
+def compact(data):
+    for column in data.columns:
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            data[column] = values.cat.remove_unused_categories()
+        elif pd.api.types.is_string_dtype(values.dtype):
+            # object, or the str dtype pandas 3 gives text columns
+            if values.nunique() <= len(values) * MAX_CATEGORY_RATIO:
+                data[column] = values.astype(pd.CategoricalDtype(sorted(values.dropna().unique())))
+        elif values.dtype.kind in 'iuf':
+            array = values.to_numpy()
+            if values.dtype.kind == 'f' and (np.isnan(array).any() or not np.array_equal(np.trunc(array), array)):
+                if values.dtype == 'float64' and np.array_equal(array.astype('float32'), array, equal_nan=True):
+                    data[column] = values.astype('float32')
+                continue
+            dtype = _narrowest_integer(array)
+            if dtype is not None and (values.dtype.kind == 'f' or dtype.itemsize < values.dtype.itemsize):
+                data[column] = values.astype(dtype)
+    return data
+
+
+# Bytes and dtype of every column before and after compact(), with a total row
+def memory_report(data, compacted=None):
+    if compacted is None:
+        compacted = compact(data.copy())
+    report = pd.DataFrame({
+        'dtype_before': data.dtypes.astype(str),
+        'bytes_before': data.memory_usage(index=False, deep=True),
+        'dtype_after': compacted.dtypes.astype(str),
+        'bytes_after': compacted.memory_usage(index=False, deep=True),
+    })
+    report.loc['total'] = ['', report['bytes_before'].sum(), '', report['bytes_after'].sum()]
+    report['saved'] = (1 - report['bytes_after'] / report['bytes_before']).round(3)
+    return report
+
+
+# Read the raw CSV with fixed dtypes and a parsed 'Date Local'
+def read_raw_csv(path=RAW_DATA_PATH, columns=None, **read_csv_kwargs):
+    data = pd.read_csv(path, usecols=_usecols(columns), dtype=RAW_DTYPES, **read_csv_kwargs)
+    return _as_categories(_parse_dates(data))
+
+
+# Yield typed chunks of `chunksize` rows from the raw CSV or from the columnar store,
+# in the same row order load_data() would return them
+def iter_data_chunks(source, columns=None, chunksize=100_000):
+    if os.path.isdir(source):
+        dataset = ds.dataset(source, format='parquet', partitioning='hive')
+        names = [name for name in (columns or dataset.schema.names) if name != 'Year']
+        for batch in dataset.to_batches(columns=names, batch_size=chunksize):
+            yield _as_categories(batch.to_pandas())
+    else:
+        reader = pd.read_csv(source, usecols=_usecols(columns), dtype=RAW_DTYPES, chunksize=chunksize)
+        for chunk in reader:
+            yield _as_categories(_parse_dates(chunk))
+
+
+# Load the columnar store, reading only the requested columns and partitions
+def load_store(path=STORE_PATH, columns=None, years=None, states=None):
+    filters = []
+    if years is not None:
+        filters.append(('Year', 'in', [int(year) for year in years]))
+    if states is not None:
+        filters.append(('State', 'in', list(states)))
+    data = pd.read_parquet(path, columns=columns, filters=filters or None)
+    # 'Year' only exists as a partition key, 'Date Local' already carries it
+    if columns is None or 'Year' not in columns:
+        data = data.drop(columns=['Year'], errors='ignore')
+    return _as_categories(data)
+
+
+# Load from the columnar store when it has been built, otherwise fall back to the raw CSV
+def load_data(columns=None, years=None, states=None, store_path=STORE_PATH, raw_path=RAW_DATA_PATH):
+    if store_path and os.path.isdir(store_path):
+        return load_store(store_path, columns=columns, years=years, states=states)
+    data = read_raw_csv(raw_path, columns=columns)
+    if years is not None:
+        data = data[data['Date Local'].dt.year.isin([int(year) for year in years])]
+    if states is not None:
+        data = data[data['State'].isin(list(states))]
+    return data
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# Width of the main column of a Streamlit page in the default (centered) layout
+CHART_WIDTH_PX = 730
+# Points drawn per horizontal pixel: one for LTTB, a min and a max for the envelope
+POINTS_PER_PIXEL = {'lttb': 1, 'minmax': 2}
+MODES = list(POINTS_PER_PIXEL)
+
+
+# Point budget of one line drawn over `width_px` pixels (e.g. half the width for side-by-side axes)
+def point_budget(width_px=CHART_WIDTH_PX, mode='lttb'):
+    return int(width_px * POINTS_PER_PIXEL[mode])
+
+
+# Largest-Triangle-Three-Buckets: keeps the first and last point and, in each of
+# n_out - 2 buckets, the point forming the largest triangle with the point kept in the
+# previous bucket and the mean of the next bucket. Preserves the visual shape of the
+# line, peaks included, with a fixed number of points. Returns positions into x and y.
+def lttb_indices(x, y, n_out):
+    n = len(y)
+    n_out = max(n_out, 3)
+    if n_out >= n:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype('int64')
+    selected = np.empty(n_out, dtype='int64')
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[stop:next_stop].mean()
+        next_y = y[stop:next_stop].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(area.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+# Min/max envelope: the lowest and highest point of each of (n_out - 2) / 2 equal-sized
+# buckets, in their original order, so every extreme of the series stays visible
+def minmax_indices(y, n_out):
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    buckets = max((n_out - 2) // 2, 1)
+    edges = np.linspace(0, n, buckets + 1).astype('int64')
+    lows = np.minimum.reduceat(y, edges[:-1])
+    highs = np.maximum.reduceat(y, edges[:-1])
+    # The first and last points keep the full extent of the x axis
+    selected = [0, n - 1]
+    for start, stop, low, high in zip(edges[:-1], edges[1:], lows, highs):
+        values = y[start:stop]
+        selected.append(start + int(np.argmax(values == low)))
+        selected.append(start + int(np.argmax(values == high)))
+    return np.unique(selected)
+
+
+def _rows(x, frame, max_points, mode):
+    x = x.asi8 if isinstance(x, pd.DatetimeIndex) else np.asarray(x)
+    x = x.astype('float64')
+    rows = []
+    for column in frame.columns:
+        values = frame[column].to_numpy(dtype='float64')
+        present = np.flatnonzero(~np.isnan(values))
+        if mode == 'lttb':
+            kept = lttb_indices(x[present], values[present], max_points)
+        else:
+            kept = minmax_indices(values[present], max_points)
+        rows.append(present[kept])
+    return np.unique(np.concatenate(rows)) if rows else np.arange(0)
+
+
+def _check_mode(mode):
+    if mode not in POINTS_PER_PIXEL:
+        raise ValueError(f"Unknown downsampling mode {mode!r}, expected one of {MODES}")
+
+
+# Reduce a time series (Series or DataFrame indexed by date or number) to at most
+# `max_points` points per column. A DataFrame keeps the union of the rows selected
+# for each column, so each line keeps its own peaks.
+def downsample(data, max_points=None, mode='lttb'):
+    _check_mode(mode)
+    if max_points is None:
+        max_points = point_budget(mode=mode)
+    if len(data) <= max_points:
+        return data
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    return data.iloc[_rows(data.index, frame, max_points, mode)]
@@ -0,0 +1,268 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from aggregates import (CITY_DATE_MEASURES, CUBE_MEASURES, daily_stats, pyramid_means, pyramid_sums, state_month_stats,
+                        trend_stats)
+from data_preprocessing import INCREMENTAL_PATH, POLLUTANT_AQI_COLUMNS, load_store, read_raw_csv
+from outliers import bounds_from_sketches, replace_outliers_with_median
+from pipeline import (GLOBAL_LEVEL, SITE_DAY_COLUMNS, SORT_COLUMNS, collapse_site_days, fill_medians, imputation_sketches,
+                      medians_from_sketches, merge_imputation_sketches, sketch_accuracy)
+from sketches import DEFAULT_RELATIVE_ACCURACY, QuantileSketch
+from streaming import arrow_schema, arrow_table
+
+# A cleaned dataset that grows by appending new daily files, without reprocessing what
+# is already stored. Layout of the dataset directory:
+#   data/Year=<year>/State=<state>/part-0.parquet   cleaned rows, sorted by City and date
+#   city_date/<year> <state>.pkl                    City x Date medians of that partition
+#   years/<year>.pkl                                daily table and trend pyramid sums of that year
+#   state.pkl                                       accumulators of everything else
+# The accumulators are mergeable: quantile sketches of every imputation level (City,
+# County, State, global) and of the outlier columns, and counts, sums and sketches behind
+# the aggregate cube. An append folds the new rows into them, cleans the new rows with
+# the updated medians and IQR bounds, and rewrites only the (Year, State) partitions and
+# the years the new rows fall in, so its cost follows the new data rather than the whole
+# history. state.pkl only holds accumulators whose size is bounded by the number of
+# groups (cities, counties, States, months), not by the number of rows: the sketches
+# keep exact counts of the whole-number AQI and hour columns and bucket the continuous
+# ones (see pipeline.sketch_accuracy()).
+#
+# Rows already stored keep the values they were cleaned with: a later append changes the
+# medians and bounds applied to later rows, not earlier ones. The first append of a
+# dataset gives the same rows as pipeline.preprocess() on those files, up to the
+# relative accuracy of the medians filling continuous columns (exactly the same with 0).
+STATE_FILE = 'state.pkl'
+DATA_DIR = 'data'
+CITY_DATE_DIR = 'city_date'
+YEAR_DIR = 'years'
+# Version of the layout above, stored in state.pkl
+FORMAT_VERSION = 2
+
+
+def is_incremental(path):
+    return path is not None and os.path.isfile(os.path.join(path, STATE_FILE))
+
+
+def _partition_path(path, year, state):
+    return os.path.join(path, DATA_DIR, f'Year={year}', f'State={state}', 'part-0.parquet')
+
+
+def _city_date_path(path, year, state):
+    return os.path.join(path, CITY_DATE_DIR, f'{year} {state}.pkl')
+
+
+def _year_path(path, year):
+    return os.path.join(path, YEAR_DIR, f'{year}.pkl')
+
+
+# Write then rename, so a crash never leaves a truncated file behind
+def _replace(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+# Count, sum, sum of products and sums of squares of every pair of columns, over the
+# rows where both are present: pairwise Pearson correlations, as DataFrame.corr() computes
+# them, follow from these sums and they add up across batches
+def _comoments(data, columns):
+    rows = {}
+    for a in columns:
+        for b in columns:
+            x, y = data[a].to_numpy(dtype='float64'), data[b].to_numpy(dtype='float64')
+            both = ~np.isnan(x) & ~np.isnan(y)
+            x, y = x[both], y[both]
+            rows[(a, b)] = [len(x), x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum()]
+    return pd.DataFrame(list(rows.values()), index=pd.MultiIndex.from_tuples(rows), columns=['n', 'sx', 'sy', 'sxx', 'syy', 'sxy'])
+
+
+def _correlation(comoments, columns):
+    n, sx, sy, sxx, syy, sxy = (comoments[column] for column in ['n', 'sx', 'sy', 'sxx', 'syy', 'sxy'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    return values.unstack().loc[columns, columns].rename_axis(index=None, columns=None)
+
+
+def _add(total, table):
+    return table if total is None else total.add(table, fill_value=0)
+
+
+# Mergeable counterparts of the aggregates.build_cube() tables, except those growing
+# with the history (City x Date medians, daily table, trend pyramid), which are kept per
+# partition and per year
+class CubeAccumulator:
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        # count, sum and sumsq by (State, Month, Pollutant), and sketches of the medians
+        self.state_month = None
+        self.state_month_sketches = {}
+        self.state_sketches = {}
+        self.comoments = None
+
+    def update(self, data):
+        measures = [measure for measure in CUBE_MEASURES if measure in data.columns]
+        stats = state_month_stats(data, measures)[['count', 'sum', 'sumsq']]
+        stats.index = stats.index.set_levels(stats.index.levels[0].astype(object), level='State')
+        self.state_month = _add(self.state_month, stats)
+        months = pd.DataFrame({'State': data['State'], 'Month': data['Date Local'].dt.month})
+        for measure in measures:
+            self.state_month_sketches.setdefault(measure, self._sketch(measure)).update(data[measure], months)
+        for column in POLLUTANT_AQI_COLUMNS:
+            self.state_sketches.setdefault(column, self._sketch(column)).update(data[column], data['State'])
+        self.comoments = _add(self.comoments, _comoments(data, POLLUTANT_AQI_COLUMNS))
+        return self
+
+    def _sketch(self, column):
+        return QuantileSketch(sketch_accuracy(column, self.relative_accuracy))
+
+    # The cube tables, without 'daily', 'city_date' and 'pyramid'
+    def cube(self):
+        stats = self.state_month.astype({'count': 'int64'}).sort_index()
+        medians = pd.concat({measure: sketch.quantile(0.5) for measure, sketch in self.state_month_sketches.items()})
+        stats['mean'] = stats['sum'] / stats['count']
+        stats['median'] = medians.reorder_levels([1, 2, 0]).reindex(stats.index).to_numpy()
+        state_median = pd.DataFrame({column: sketch.quantile(0.5) for column, sketch in self.state_sketches.items()})
+        return {
+            'state_month': stats[['count', 'sum', 'sumsq', 'mean', 'median']],
+            'state_median': state_median.rename_axis('State').sort_index(),
+            'correlation': _correlation(self.comoments, POLLUTANT_AQI_COLUMNS),
+        }
+
+
+def _new_state(data, relative_accuracy):
+    return {
+        'version': FORMAT_VERSION,
+        'relative_accuracy': relative_accuracy,
+        'columns': list(data.columns),
+        'schema': arrow_schema(data.drop(columns='State')),
+        'imputation': None,
+        'outliers': {column: QuantileSketch(sketch_accuracy(column, relative_accuracy)) for column in POLLUTANT_AQI_COLUMNS},
+        'cube': CubeAccumulator(relative_accuracy),
+        'rows': 0,
+    }
+
+
+def _read_state(path):
+    state = pd.read_pickle(os.path.join(path, STATE_FILE))
+    if state.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path} was written by another version of incremental.py; "
+                         "append its source files again into a new dataset")
+    return state
+
+
+# daily_stats() and pyramid_sums() of `data`, split by year: {year: {'daily': table,
+# (level, resolution): table}}. Pyramid periods go to the year they end in, so a week
+# at the turn of a year is summed in a single file.
+def _year_tables(data):
+    years = {}
+    daily = daily_stats(data)
+    for year, table in daily.groupby(daily.index.year):
+        years.setdefault(year, {})['daily'] = table
+    for key, sums in pyramid_sums(trend_stats(data)).items():
+        for year, table in sums.groupby(sums.index.get_level_values('Date Local').year):
+            years.setdefault(year, {})[key] = table
+    return years
+
+
+# Add the year tables of new rows to those stored
+def _add_year(path, year, tables):
+    target = _year_path(path, year)
+    stored = pd.read_pickle(target) if os.path.isfile(target) else {}
+    tables = {**stored, **{key: _add(stored.get(key), table) for key, table in tables.items()}}
+    _replace(target, lambda target: pd.to_pickle(tables, target))
+
+
+# Rows already stored in the given (Year, State) partitions, keyed by partition
+def _stored_partitions(path, partitions):
+    if not partitions or not os.path.isdir(os.path.join(path, DATA_DIR)):
+        return {}
+    years = sorted({year for year, _ in partitions})
+    states = sorted({state for _, state in partitions})
+    data = load_store(os.path.join(path, DATA_DIR), years=years, states=states)
+    year = data['Date Local'].dt.year.astype(int)
+    return {key: rows for key, rows in data.groupby([year, data['State'].astype(object)], sort=False)
+            if key in partitions}
+
+
+# Clean `files` (raw CSV, or columnar stores) into the incremental dataset at `path`,
+# creating it on the first call. Site-days already stored are skipped, the stored
+# ones win. relative_accuracy is that of the sketches of continuous columns, fixed when
+# the dataset is created: 0 keeps exact value counts of them too, which grow with the
+# history, and so does the cost of every append.
+def append_files(files, path=INCREMENTAL_PATH, columns=None, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    frames = [load_store(source, columns) if os.path.isdir(source) else read_raw_csv(source, columns) for source in files]
+    data, collapsed = collapse_site_days(pd.concat(frames, ignore_index=True))
+    state = _read_state(path) if is_incremental(path) else _new_state(data, relative_accuracy)
+    data = data[[column for column in state['columns'] if column in data.columns]]
+
+    # Rows without a date are dropped by the cleaning, rows without a State have no partition
+    placed = data.dropna(subset=['Date Local', 'State'])
+    partitions = set(zip(placed['Date Local'].dt.year.astype(int), placed['State'].astype(object)))
+    stored = _stored_partitions(path, partitions)
+    if stored:
+        known = pd.concat([rows[SITE_DAY_COLUMNS] for rows in stored.values()])
+        duplicate = pd.MultiIndex.from_frame(data[SITE_DAY_COLUMNS]).isin(pd.MultiIndex.from_frame(known))
+        data = data[~duplicate]
+    already_stored = collapsed['rows_out'] - len(data)
+    if data.empty and is_incremental(path):
+        # Nothing new: the dataset is left as it is. With no row to fill, the report only
+        # needs the imputed columns, which the global medians give.
+        _, imputed = fill_medians(data, medians_from_sketches({GLOBAL_LEVEL: state['imputation'][GLOBAL_LEVEL]}))
+        return {'rows_in': collapsed['rows_in'], 'rows_out': 0, 'rows_total': state['rows'],
+                'site_day_duplicates': collapsed['rows_removed'], 'already_stored': already_stored,
+                'partitions': 0, 'imputed': imputed}
+
+    state['imputation'] = merge_imputation_sketches(state['imputation'],
+                                                    imputation_sketches(data, relative_accuracy=state['relative_accuracy']))
+    data, imputed = fill_medians(data, medians_from_sketches(state['imputation']))
+    data = data.dropna(subset=['Date Local', 'State'])
+    for column in POLLUTANT_AQI_COLUMNS:
+        state['outliers'][column].update(data[column])
+    replace_outliers_with_median(data, POLLUTANT_AQI_COLUMNS, bounds=bounds_from_sketches(state['outliers']))
+    state['cube'].update(data)
+    state['rows'] += len(data)
+
+    city_measures = [measure for measure in CITY_DATE_MEASURES if measure in data.columns]
+    new = data.groupby([data['Date Local'].dt.year.astype(int), data['State'].astype(object)], sort=False)
+    for (year, state_name), rows in new:
+        if (year, state_name) in stored:
+            rows = pd.concat([stored[(year, state_name)], rows], ignore_index=True)
+        rows = rows.sort_values(SORT_COLUMNS, kind='stable', ignore_index=True)
+        table = arrow_table(rows.drop(columns='State'), state['schema'])
+        _replace(_partition_path(path, year, state_name), lambda target: pq.write_table(table, target))
+        city_date = rows.groupby([rows['State'].astype(object), rows['City'].astype(object), 'Date Local'])[city_measures].median()
+        _replace(_city_date_path(path, year, state_name), lambda target: pd.to_pickle(city_date, target))
+    for year, tables in _year_tables(data).items():
+        _add_year(path, year, tables)
+    # Saved last: an interrupted append leaves the previous statistics in place
+    _replace(os.path.join(path, STATE_FILE), lambda target: pd.to_pickle(state, target))
+    return {'rows_in': collapsed['rows_in'], 'rows_out': len(data), 'rows_total': state['rows'],
+            'site_day_duplicates': collapsed['rows_removed'], 'already_stored': already_stored,
+            'partitions': new.ngroups, 'imputed': imputed}
+
+
+# The stored rows sorted by (State, City, Date Local), as pipeline.preprocess() returns them
+def load_incremental(path=INCREMENTAL_PATH, columns=None):
+    order = [column for column in _read_state(path)['columns'] if columns is None or column in columns]
+    data = load_store(os.path.join(path, DATA_DIR), columns=columns)
+    return data[order].sort_values(SORT_COLUMNS, kind='stable', ignore_index=True)
+
+
+def _read_tables(directory):
+    return [pd.read_pickle(os.path.join(directory, name)) for name in sorted(os.listdir(directory)) if name.endswith('.pkl')]
+
+
+# The aggregates.build_cube() tables of the stored rows, from the accumulators. Tables
+# of different years hold different dates and periods, so they are only concatenated.
+def incremental_cube(path=INCREMENTAL_PATH):
+    cube = _read_state(path)['cube'].cube()
+    years = _read_tables(os.path.join(path, YEAR_DIR))
+    cube['daily'] = pd.concat([tables['daily'] for tables in years if 'daily' in tables]).sort_index()
+    cube['daily']['count'] = cube['daily']['count'].astype('int64')
+    cube['city_date'] = pd.concat(_read_tables(os.path.join(path, CITY_DATE_DIR))).sort_index()
+    keys = dict.fromkeys(key for tables in years for key in tables if key != 'daily')
+    cube['pyramid'] = pyramid_means({key: pd.concat([tables[key] for tables in years if key in tables]).sort_index()
+                                     for key in keys})
+    return cube
@@ -0,0 +1,77 @@
+import argparse
+import os
+import shutil
+import time
+
+from data_preprocessing import INCREMENTAL_PATH, RAW_DATA_PATH, STORE_PATH, read_raw_csv
+from incremental import append_files
+from streaming import CLEAN_DATA_PATH, parse_size, stream_preprocess
+
+PARTITION_SCHEMES = {
+    'year': ['Year'],
+    'state': ['State'],
+    'year,state': ['Year', 'State'],
+}
+
+
+# Convert the raw EPA CSV once into a typed, partitioned parquet store
+def convert_to_store(source=RAW_DATA_PATH, destination=STORE_PATH, partition='year,state', overwrite=False):
+    partition_cols = PARTITION_SCHEMES[partition]
+    if os.path.exists(destination):
+        if not overwrite:
+            raise FileExistsError(f"{destination} already exists, pass overwrite=True to rebuild it")
+        shutil.rmtree(destination)
+
+    # Rows without a parseable date have no partition and are dropped by every dashboard anyway
+    data = read_raw_csv(source).dropna(subset=['Date Local'])
+    data['Year'] = data['Date Local'].dt.year.astype('int16')
+    data.to_parquet(destination, engine='pyarrow', partition_cols=partition_cols, index=False)
+    return len(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the pollution CSV into a columnar store.")
+    parser.add_argument('source', nargs='?', default=RAW_DATA_PATH, help="raw CSV (or store, with --clean) to convert")
+    parser.add_argument('--out', help=f"output path (default {STORE_PATH}, or {CLEAN_DATA_PATH} with --clean)")
+    parser.add_argument('--partition', choices=sorted(PARTITION_SCHEMES), default='year,state',
+                        help="partition columns of the store")
+    parser.add_argument('--overwrite', action='store_true', help="replace an existing output")
+    parser.add_argument('--clean', action='store_true',
+                        help="write the cleaned dataset instead, processing the input chunk by chunk")
+    parser.add_argument('--memory-limit', default='512MB', help="memory budget of --clean, e.g. 256MB or 2G")
+    parser.add_argument('--relative-accuracy', type=float,
+                        help="relative error allowed in the medians of the continuous Mean and Max Value columns of "
+                             "--clean, or in the statistics of a dataset created by --append (default 0.01); "
+                             "the whole-number AQI and hour columns are always exact, 0 makes everything exact")
+    parser.add_argument('--append', nargs='+', metavar='FILE',
+                        help=f"clean these new files into the incremental dataset (--out, default {INCREMENTAL_PATH}), "
+                             "updating its statistics and aggregates; it is created on the first append")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    accuracy = {} if args.relative_accuracy is None else {'relative_accuracy': args.relative_accuracy}
+    if args.append:
+        out = args.out or INCREMENTAL_PATH
+        report = append_files(args.append, out, **accuracy)
+        print(f"Appended {report['rows_out']} cleaned rows of {report['rows_in']} to {out} "
+              f"({report['rows_total']} rows, {report['partitions']} partitions rewritten) in {time.perf_counter() - start:.1f}s")
+        print(f"Collapsed {report['site_day_duplicates']} duplicate site-day rows, skipped {report['already_stored']} already stored")
+        print("Missing values filled per column, by imputation level:")
+        print(report['imputed'].to_string())
+    elif args.clean:
+        out = args.out or CLEAN_DATA_PATH
+        if os.path.exists(out) and not args.overwrite:
+            parser.error(f"{out} already exists, pass --overwrite to rebuild it")
+        report = stream_preprocess(args.source, out, memory_limit=parse_size(args.memory_limit), **accuracy)
+        print(f"Cleaned {report['rows_in']} rows into {report['rows_out']} rows in {out} "
+              f"({report['chunksize']} rows per chunk) in {time.perf_counter() - start:.1f}s")
+        print(f"Collapsed {report['site_day_duplicates']} duplicate site-day rows")
+        print("Missing values filled per column, by imputation level:")
+        print(report['imputed'].to_string())
+    else:
+        out = args.out or STORE_PATH
+        rows = convert_to_store(args.source, out, partition=args.partition, overwrite=args.overwrite)
+        print(f"Wrote {rows} rows to {out} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -1,111 +1,25 @@
 import streamlit as st
 import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px 
+from analytics import load_dashboard
+from charts import (city_figure, correlation_figure, seasonal_figure, state_bar_figure, state_heatmap_figure,
+                    state_trends_figure, top_states_bar_figure, top_states_figure, trend_figure)
+from profiling import start_profiling
+from sections import section
+from visualization import show_plotly, show_profile, show_pyplot
 
 # st.markdown("<h1 style='text-align: center;'><img src='image.png' width='150'></h1>", unsafe_allow_html=True)
 st.image('image.png',width = 200)
 # Title with custom color
 st.markdown("<h1 style='color: #1E90FF;'>Air Quality Analysis Dashboard</h1>", unsafe_allow_html=True)
 st.markdown("<h3 style='color: #32CD32;'>Explore Air Quality Data by Pollutants, Regions, and Time Periods.</h3>", unsafe_allow_html=True)
-@st.cache
-def load_data():
-    # Load and preprocess your dataset here
-    data = pd.read_csv("sampled_dataset.csv")
-    return data
-data = load_data()
 
+# Optional timing and memory profile of each section of this rerun (see profiling.py)
+profiler = start_profiling('main', st.sidebar.checkbox("Profile this page", key="profiling"))
 
-# Drop irrelevant columns
-if 'Unnamed: 0' in data.columns:
-    data = data.drop(columns=['Unnamed: 0'])
-
-missing_values = data.isnull().sum()
-
-data['SO2 AQI'] = data.groupby('City')['SO2 AQI'].transform(lambda x: x.fillna(x.median()))
-data['CO AQI'] = data.groupby('City')['CO AQI'].transform(lambda x: x.fillna(x.median()))
-
-
-missing_values = data.isnull().sum()
-
-data['Date Local'] = pd.to_datetime(data['Date Local'], errors='coerce')
-data = data.dropna(subset=['Date Local'])
-
-
-
-# Assuming 'data' is your DataFrame
-outliers_columns = data[['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']]
-
-# Function to detect outliers using IQR method
-def detect_outliers_iqr(data, column):
-    Q1 = data[column].quantile(0.25)  # First quartile (25%)
-    Q3 = data[column].quantile(0.75)  # Third quartile (75%)
-    IQR = Q3 - Q1  # Interquartile range
-
-    # Define lower and upper bounds for outliers
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-
-    # Find outliers
-    outliers = data[(data[column] < lower_bound) | (data[column] > upper_bound)]
-    
-    # Create a DataFrame without outliers
-    df_no_outliers = data[(data[column] >= lower_bound) & (data[column] <= upper_bound)]
-    return outliers, df_no_outliers
-
-# Function to replace outliers with median
-def replace_outliers_with_median(data, column):
-    Q1 = data[column].quantile(0.25)
-    Q3 = data[column].quantile(0.75)
-    IQR = Q3 - Q1
-
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-
-    median_value = data[column].median()
-    data[column] = data[column].apply(lambda x: median_value if (x < lower_bound or x > upper_bound) else x)
-
-# Sample dataset (replace with your actual dataset)
-# data = pd.read_csv('your_dataset.csv')
-
-# Assume you have a dataframe called outliers_columns with these columns
-outliers_columns = data[['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']]
-
-# Detect outliers before replacement for each column and store them separately
-outliers_NO2_AQI, data_NO2_AQI = detect_outliers_iqr(outliers_columns, 'NO2 AQI')
-outliers_O3_AQI, data_O3_AQI = detect_outliers_iqr(outliers_columns, 'O3 AQI')
-outliers_SO2_AQI, data_SO2_AQI = detect_outliers_iqr(outliers_columns, 'SO2 AQI')
-outliers_CO_AQI, data_CO_AQI = detect_outliers_iqr(outliers_columns, 'CO AQI')
-
-# Combine all outliers in one table before replacement
-outliers_combined_before = pd.concat([outliers_NO2_AQI[['NO2 AQI']],
-                                      outliers_O3_AQI[['O3 AQI']],
-                                      outliers_SO2_AQI[['SO2 AQI']],
-                                      outliers_CO_AQI[['CO AQI']]], axis=1)
-
-# Replace outliers with median for each column
-replace_outliers_with_median(outliers_columns, 'NO2 AQI')
-replace_outliers_with_median(outliers_columns, 'O3 AQI')
-replace_outliers_with_median(outliers_columns, 'SO2 AQI')
-replace_outliers_with_median(outliers_columns, 'CO AQI')
-
-# Combine all data after replacement into one table
-data_combined_after = pd.concat([outliers_columns[['NO2 AQI']],
-                                 outliers_columns[['O3 AQI']],
-                                 outliers_columns[['SO2 AQI']],
-                                 outliers_columns[['CO AQI']]], axis=1)
-
-# Display Outliers Before Replacement in Streamlit
-
-
-# Display Outliers After Replacement in Streamlit
-
-data_without_date = data.drop(columns=['Date Local'])
-
-# Show summary statistics for all columns except 'Date Local'
+# Cleaned dataset (loading, City median imputation, date cleanup and outlier replacement),
+# aggregate cube and State/City index, built once per dataset version and cached (see analytics.py).
+# Rendered charts are cached per dataset version, chart and parameters (see visualization.py)
+data, cube, index, version = load_dashboard()
 
 # Pollutant selection
 st.sidebar.markdown("<h4 style='color: #1E90FF;'>Choose a Pollutant</h4>", unsafe_allow_html=True)
@@ -113,37 +27,33 @@ pollutant = st.sidebar.selectbox("Select Pollutant", ['NO2 Mean', 'O3 Mean', 'SO
 
 # Date range filter with default date handling
 st.sidebar.markdown("<h4 style='color: #1E90FF;'>Date Range</h4>", unsafe_allow_html=True)
-start_date = st.sidebar.date_input("Start Date", data['Date Local'].min().to_pydatetime().date())
-end_date = st.sidebar.date_input("End Date", data['Date Local'].max().to_pydatetime().date())
+start_date = st.sidebar.date_input("Start Date", pd.Timestamp(index.min_date).date())
+end_date = st.sidebar.date_input("End Date", pd.Timestamp(index.max_date).date())
 
-# Filter data based on date range
-data_filtered = data[(data['Date Local'] >= pd.to_datetime(start_date)) & (data['Date Local'] <= pd.to_datetime(end_date))]
+# Date range as timestamps; rows are never filtered with a full-column scan, the
+# location index and the aggregate tables slice by date instead
+start_ts, end_ts = pd.to_datetime(start_date), pd.to_datetime(end_date)
 
 # Temporal Trend Visualization
-if pollutant in data_filtered.columns:
-    st.markdown(f"<h3 style='color: #FFD700;'>Temporal Trend of {pollutant}</h3>", unsafe_allow_html=True)
-    data_grouped = data_filtered.groupby("Date Local")[pollutant].mean().resample('ME').mean()
-    fig, ax = plt.subplots(figsize=(10, 6))
-    data_grouped.plot(ax=ax, color='tab:blue', lw=2)
-    ax.set_title(f"{pollutant} Levels Over Time", fontsize=16, color='darkorange')
-    ax.set_xlabel("Date", fontsize=12, color='darkgreen')
-    ax.set_ylabel("Pollutant Level", fontsize=12, color='darkgreen')
-    ax.grid(True)
-    ax.set_xticks(data_grouped.index[::max(len(data_grouped) // 6, 1)])
-    ax.set_xticklabels(data_grouped.index.strftime('%Y-%m-%d')[::max(len(data_grouped) // 6, 1)], rotation=45)
-    st.pyplot(fig)
+@section('temporal_trend')
+def temporal_trend_section(pollutant, start_ts, end_ts):
+    if pollutant in data.columns:
+        st.markdown(f"<h3 style='color: #FFD700;'>Temporal Trend of {pollutant}</h3>", unsafe_allow_html=True)
+
+        show_pyplot('main.temporal_trend', lambda: trend_figure(cube, pollutant, start_ts, end_ts),
+                    (pollutant, start_ts, end_ts), version)
+
+temporal_trend_section(pollutant, start_ts, end_ts)
 
 
 # State filter
 st.sidebar.markdown("<h4 style='color: #1E90FF;'>Select State</h4>", unsafe_allow_html=True)
-state = st.sidebar.selectbox("Select State", data_filtered['State'].unique())
+state = st.sidebar.selectbox("Select State", index.states(start_ts, end_ts))
 
-# Filter data by state
-state_data = data_filtered[data_filtered['State'] == state]
+# Only show cities of the selected state with data in the date range (an index lookup)
+city_options = index.cities(state, start_ts, end_ts)
 
-if not state_data.empty:
-    # Only show cities present in the filtered `state_data` DataFrame
-    city_options = state_data['City'].dropna().unique()
+if city_options:
     st.sidebar.markdown("<h4 style='color: #1E90FF;'>Select City</h4>", unsafe_allow_html=True)
     city = st.sidebar.selectbox("Select City", city_options)
 else:
@@ -161,165 +71,86 @@ else:
 # st.plotly_chart(fig)
 
 # Plot most populated states
-st.markdown(f"<h3 style='color: #FF6347;'>Top Pollutant Level states</h3>", unsafe_allow_html=True)
-topstatesdata = data[["State", 'NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']].groupby("State").median()
-toptenstatesdata = topstatesdata.sort_values(by=['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI'], ascending=False)[:10]
-fig, ax = plt.subplots()
-toptenstatesdata.plot(kind="bar", ax=ax)
-st.pyplot(fig)
+@section('top_states')
+def top_states_section():
+    st.markdown(f"<h3 style='color: #FF6347;'>Top Pollutant Level states</h3>", unsafe_allow_html=True)
 
-# Filter data for the selected city
-city_data = state_data[state_data['City'] == city]
+    show_pyplot('main.top_states', lambda: top_states_figure(cube), version=version)
 
-# Groupby data using date local
-city_data = city_data[['Date Local', 'NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI', 'NO2 1st Max Value', 'O3 1st Max Value', 'SO2 1st Max Value', 'CO 1st Max Value']].groupby("Date Local").median()
+top_states_section()
 
 # AQI and Peak Values bar chart for selected city
-st.subheader(f"AQI Levels and Peak Values for {city}")
-fig, axs = plt.subplots(1, 2, figsize=(15,5))
-
-# AQI Line Chart
-city_data[['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']].plot(kind="line", ax=axs[0])
-axs[0].set_title("AQI Levels by Pollutant")
-axs[0].set_xlabel("Date")
-axs[0].set_ylabel("AQI Level")
-
-# Max Value Line Chart
-city_data[['NO2 1st Max Value', 'O3 1st Max Value', 'SO2 1st Max Value', 'CO 1st Max Value']].plot(kind="line", ax=axs[1])
-axs[1].set_title("Peak Pollutant Levels")
-axs[1].set_xlabel("Date")
-axs[1].set_ylabel("Pollutant Level")
-st.pyplot(fig)
+@section('city')
+def city_section(state, city, start_ts, end_ts):
+    st.subheader(f"AQI Levels and Peak Values for {city}")
+
+    show_pyplot('main.city', lambda: city_figure(cube, state, city, start_ts, end_ts), (state, city, start_ts, end_ts), version)
+
+city_section(state, city, start_ts, end_ts)
 
 #Pollution Correlations
+@section('correlation')
+def correlation_section():
+
+    st.markdown("<h3 style='color: #FF6347;'>Pollutant Correlations</h3>", unsafe_allow_html=True)
+
+    show_pyplot('main.correlation', lambda: correlation_figure(cube), version=version)
 
-st.markdown("<h3 style='color: #FF6347;'>Pollutant Correlations</h3>", unsafe_allow_html=True)
-correlation_data = data[['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']].corr()
-fig, ax = plt.subplots(figsize=(8, 6))
-sns.heatmap(correlation_data, annot=True, cmap='coolwarm', ax=ax, linewidths=0.5)
-ax.set_title("Correlation Heatmap", fontsize=16)
-st.pyplot(fig)
+correlation_section()
 
 #Seasonal Trends of pollutants by month
-st.markdown("<h3 style='color: #1E90FF;'>Seasonal Trends of Pollutants</h3>", unsafe_allow_html=True)
-data['Month'] = data['Date Local'].dt.month
-seasonal_data = data.groupby('Month')[['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']].mean()
-fig, ax = plt.subplots(figsize=(10, 6))
-seasonal_data.plot(ax=ax, colormap='coolwarm', marker='o')
-ax.set_title("Average Pollutant Levels by Month", fontsize=16)
-ax.set_xlabel("Month")
-ax.set_ylabel("Pollutant AQI")
-st.pyplot(fig)
+@section('seasonal')
+def seasonal_section():
+    st.markdown("<h3 style='color: #1E90FF;'>Seasonal Trends of Pollutants</h3>", unsafe_allow_html=True)
+
+    show_pyplot('main.seasonal', lambda: seasonal_figure(cube), version=version)
+
+seasonal_section()
 
 # Pollutant levels for selected state
-st.markdown("<h3 style='color: #FF6347;'>Pollutant Levels for each state</h3>", unsafe_allow_html=True)
-pollutant_options = ['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']
-
-# Add a selectbox with a unique key
-pollutant_map = st.selectbox("Select a pollutant to visualize:", pollutant_options, key="pollutant_map_selectbox")
-
-state_pollutant_pivot = data.pivot_table(
-    index="State",
-    values=pollutant_map,
-    aggfunc="mean"
-).sort_values(by=pollutant_map, ascending=False)
-
-fig, ax = plt.subplots(figsize=(10, 6))
-sns.heatmap(
-    state_pollutant_pivot,
-    cmap="YlGnBu",
-    annot=True,
-    fmt=".1f",
-    ax=ax
-)
-plt.title(f"Heatmap of {pollutant_map} Levels Across States")
-st.pyplot(fig)
-
-#Heat Map of selected pollutant levels
-st.markdown("<h3 style='color: #FF6347;'>Heat Map for Pollutant levels</h3>", unsafe_allow_html=True)
-state_pollutant_avg = data.groupby('State')[pollutant_map].mean().reset_index()
-
-top_states = state_pollutant_avg.nlargest(10, pollutant_map)
-
-fig_top_states = px.bar(
-    top_states,
-    x=pollutant_map,
-    y='State',
-    orientation='h',
-    title=f"Top 10 States with Highest {pollutant_map} Levels",
-    labels={pollutant_map: f'{pollutant_map} Level'},
-    color=pollutant_map,
-    color_continuous_scale='Inferno'
-)
-st.plotly_chart(fig_top_states)
+# Owns the pollutant_map selectbox, so changing it reruns this section and the state
+# trends section nested in it, not the page
+@section('state_levels')
+def state_levels_section():
+    st.markdown("<h3 style='color: #FF6347;'>Pollutant Levels for each state</h3>", unsafe_allow_html=True)
+    pollutant_options = ['NO2 AQI', 'O3 AQI', 'SO2 AQI', 'CO AQI']
 
+    # Add a selectbox with a unique key
+    pollutant_map = st.selectbox("Select a pollutant to visualize:", pollutant_options, key="pollutant_map_selectbox")
 
 
-# Create a bar chart for average levels by state
-fig_bar = px.bar(
-    state_pollutant_avg,
-    x='State',
-    y=pollutant_map,
-    title=f"Average {pollutant_map} Levels by State",
-    labels={'State': 'State', pollutant_map: f'{pollutant_map} Level'},
-    color=pollutant_map,
-    color_continuous_scale='Viridis'
-)
-st.plotly_chart(fig_bar)
+    show_pyplot('main.state_heatmap', lambda: state_heatmap_figure(cube, pollutant_map), (pollutant_map,), version)
 
-import pandas as pd
-import plotly.express as px
-import streamlit as st
+    #Heat Map of selected pollutant levels
+    st.markdown("<h3 style='color: #FF6347;'>Heat Map for Pollutant levels</h3>", unsafe_allow_html=True)
+    show_plotly('main.top_states_bar', lambda: top_states_bar_figure(cube, pollutant_map), (pollutant_map,), version)
 
-# Sample data setup (replace with your data)
-# data = pd.read_csv('your_data.csv')  # Replace with actual data
+    # Create a bar chart for average levels by state
+    show_plotly('main.state_bar', lambda: state_bar_figure(cube, pollutant_map), (pollutant_map,), version)
 
-st.markdown("<h3 style='color: #FF6347;'>Line Chart for Pollutant Trends by State</h3>", unsafe_allow_html=True)
+    state_trends_section(pollutant_map)
 
-# Filter for specific states (optional)
-selected_states = st.multiselect("Select states to visualize:", data['State'].unique())
 
-if selected_states:
-    # Limit the number of selected states to avoid clutter
-    if len(selected_states) > 5:
-        st.warning("Please select up to 5 states for better visualization.")
+# Owns the state multiselect, so changing it reruns this section only. Nested in the state
+# levels section, which passes it the pollutant chosen there.
+@section('state_trends')
+def state_trends_section(pollutant_map):
+    st.markdown("<h3 style='color: #FF6347;'>Line Chart for Pollutant Trends by State</h3>", unsafe_allow_html=True)
+
+    # Filter for specific states (optional)
+    selected_states = st.multiselect("Select states to visualize:", index.states())
+
+    if selected_states:
+        # Limit the number of selected states to avoid clutter
+        if len(selected_states) > 5:
+            st.warning("Please select up to 5 states for better visualization.")
+        else:
+            show_plotly('main.state_trends', lambda: state_trends_figure(cube, selected_states, pollutant_map),
+                        (tuple(selected_states), pollutant_map), version)
     else:
-        filtered_data = data[data['State'].isin(selected_states)].copy()
-        
-        # Resample data to monthly averages for smoother visualization
-        filtered_data['Date Local'] = pd.to_datetime(filtered_data['Date Local'])
-        filtered_data.set_index('Date Local', inplace=True)
-        resampled_data = (
-            filtered_data.groupby(['State', pd.Grouper(freq='M')])  # Group by month
-            .agg({pollutant_map: 'mean'})  # Use mean of pollutant levels per month
-            .reset_index()
-        )
-
-        # Apply a rolling average to smooth the trend lines (optional)
-        window_size = 7  # Define window size for rolling average
-        resampled_data[f'{pollutant_map}_Rolling'] = resampled_data.groupby('State')[pollutant_map].transform(lambda x: x.rolling(window=window_size).mean())
-
-        # Plot line chart using smoothed data
-        fig_line = px.line(
-            resampled_data,
-            x="Date Local",
-            y=f'{pollutant_map}_Rolling',  # Use the rolling average
-            color="State",
-            title=f"Trends of {pollutant_map} Levels in Selected States (Smoothed)",
-            labels={"Date Local": "Date", f'{pollutant_map}_Rolling': f"{pollutant_map} Level"},
-            line_shape="spline"  # Smooth the lines with a spline
-        )
-
-        fig_line.update_layout(
-            xaxis_title="Date",
-            yaxis_title=f"{pollutant_map} Level",
-            legend_title="State",
-            template="plotly_white",
-            showlegend=True,
-        )
-        st.plotly_chart(fig_line)
-else:
-    st.warning("Please select at least one state to visualize trends.")
+        st.warning("Please select at least one state to visualize trends.")
+
+state_levels_section()
 
 
 # Footer section
@@ -354,3 +185,5 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+
+show_profile(profiler)
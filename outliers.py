@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import POLLUTANT_AQI_COLUMNS
+from sketches import sketch_columns
+
+IQR_FACTOR = 1.5
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+def _bounds_table(q1, median, q3, grouped):
+    iqr = q3 - q1
+    statistics = {
+        'Q1': q1, 'median': median, 'Q3': q3,
+        'lower': q1 - IQR_FACTOR * iqr, 'upper': q3 + IQR_FACTOR * iqr,
+    }
+    return pd.concat(statistics, axis=1) if grouped else pd.DataFrame(statistics).T
+
+
+# Q1, median, Q3 and the IQR bounds of every column, from a single quantile pass.
+# With `by` (e.g. 'State' or 'City') the statistics are computed per group and the
+# result has one row per group and (statistic, column) columns.
+# With `relative_accuracy` the quantiles come from quantile sketches (see sketches.py)
+# instead of DataFrame.quantile, within that relative error of the exact values.
+def iqr_bounds(data, columns=POLLUTANT_AQI_COLUMNS, by=None, relative_accuracy=None):
+    columns = list(columns)
+    if relative_accuracy is not None:
+        bounds = bounds_from_sketches(sketch_columns(data, columns, by, relative_accuracy))
+        if by is None:
+            return bounds
+        # Keep a row for groups with no values, as groupby().quantile() does, so rows line up with _group_codes
+        return bounds.reindex(data.groupby(by, observed=True).size().index)
+    if by is None:
+        quantiles = data[columns].quantile(QUANTILES)
+        return _bounds_table(*(quantiles.loc[q] for q in QUANTILES), grouped=False)
+
+    quantiles = data.groupby(by, observed=True)[columns].quantile(QUANTILES).unstack()
+    return _bounds_table(*(quantiles.xs(q, axis=1, level=-1) for q in QUANTILES), grouped=True)
+
+
+# The iqr_bounds table from one QuantileSketch per column, e.g. merged over the chunks
+# or partitions of a dataset too large to hold in memory
+def bounds_from_sketches(sketches):
+    quantiles = {column: sketch.quantiles(QUANTILES) for column, sketch in sketches.items()}
+    grouped = any(isinstance(values, pd.DataFrame) for values in quantiles.values())
+    if grouped:
+        quantiles = pd.concat(quantiles, axis=1)
+        return _bounds_table(*(quantiles.xs(q, axis=1, level=-1) for q in QUANTILES), grouped=True)
+    quantiles = pd.DataFrame(quantiles)
+    return _bounds_table(*(quantiles.loc[q] for q in QUANTILES), grouped=False)
+
+
+# Position of each row's group in the bounds table, -1 for rows without a group
+def _group_codes(data, by):
+    if by is None:
+        return None
+    return data.groupby(by, observed=True, sort=True).ngroup().fillna(-1).to_numpy(dtype='int64')
+
+
+# Broadcast one statistic of the bounds table to a (rows, columns) array aligned with `data`
+def _row_statistic(bounds, statistic, columns, codes):
+    if codes is None:
+        return bounds.loc[statistic, columns].to_numpy(dtype='float64')[np.newaxis, :]
+    table = bounds[statistic][columns].to_numpy(dtype='float64')
+    # Code -1 picks the trailing all-NaN row, so rows without a group are never outliers
+    table = np.vstack([table, np.full((1, len(columns)), np.nan)])
+    return table[codes]
+
+
+def _outlier_mask(data, bounds, columns, codes):
+    values = data[columns].to_numpy(dtype='float64')
+    lower = _row_statistic(bounds, 'lower', columns, codes)
+    upper = _row_statistic(bounds, 'upper', columns, codes)
+    return (values < lower) | (values > upper)
+
+
+# Flag outliers in every column at once: True where a value falls outside its IQR bounds
+def detect_outliers_iqr(data, columns=POLLUTANT_AQI_COLUMNS, by=None, bounds=None, relative_accuracy=None):
+    columns = list(columns)
+    if bounds is None:
+        bounds = iqr_bounds(data, columns, by=by, relative_accuracy=relative_accuracy)
+    mask = _outlier_mask(data, bounds, columns, _group_codes(data, by))
+    return pd.DataFrame(mask, index=data.index, columns=columns)
+
+
+# Replace outliers in every column with the (global or per-group) median, in place
+def replace_outliers_with_median(data, columns=POLLUTANT_AQI_COLUMNS, by=None, bounds=None, relative_accuracy=None):
+    columns = list(columns)
+    if bounds is None:
+        bounds = iqr_bounds(data, columns, by=by, relative_accuracy=relative_accuracy)
+    codes = _group_codes(data, by)
+    mask = _outlier_mask(data, bounds, columns, codes)
+    median = np.broadcast_to(_row_statistic(bounds, 'median', columns, codes), mask.shape)
+    for i, column in enumerate(columns):
+        if mask[:, i].any():
+            values = data[column].to_numpy(copy=True)
+            values[mask[:, i]] = median[mask[:, i], i]
+            data[column] = values
+    return data
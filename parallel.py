@@ -0,0 +1,277 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import POLLUTANT_AQI_COLUMNS
+from outliers import bounds_from_sketches, replace_outliers_with_median
+from pipeline import (GLOBAL_LEVEL, IMPUTATION_LEVELS, IMPUTED_COLUMNS, SORT_COLUMNS, collapse_site_days, fill_medians,
+                      imputation_medians, preprocess)
+from profiling import span
+from sketches import QuantileSketch
+
+# Preprocessing across a process pool, one shard of rows per task, with the same result
+# as pipeline.preprocess() on the whole frame.
+#
+# The imputation medians and the IQR bounds are statistics of the whole dataset (the
+# County, State and global fallbacks, and the bounds, span shards), so they cannot be
+# computed per shard. They are computed exactly, as the serial pipeline does, by tasks
+# reading the shared rows of every shard, then broadcast back for the cleaning pass:
+#   1. collapse site-days (State shards hold whole groups of every imputation level and
+#      return their medians), then tasks over a few imputed columns each for the medians
+#      spanning shards: the global ones, and with year shards those of every level
+#   2. impute and drop bad dates, exact value counts of the outlier columns (whole-number
+#      AQI values, a few hundred per column) -> IQR bounds
+#   3. replace outliers and sort the shard
+# Rows travel through shared memory, one block for the input columns and one for the
+# cleaned output; tasks only receive the block layout and their row range. The parent
+# takes each column once into the input block in shard order, and gathers the result
+# once from the output block. Tasks work on views of their rows and write back only the
+# columns a step changed. Every site-day lies in a single shard, whether shards are
+# States or years.
+SHARD_KEYS = ('State', 'year')
+# Original row position, kept alongside the data so shards can be merged in serial order
+_ROW = '_row'
+
+
+# Layout of a frame in a shared memory block: (column, dtype, categories, offset) per
+# column, categoricals stored as their codes and datetimes as their int64 values, then
+# the original position of every row
+def _layout(data):
+    layout = []
+    offset = 0
+    for column in data.columns:
+        dtype = data[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            layout.append((column, data[column].cat.codes.dtype.str, dtype, offset))
+            offset += data[column].cat.codes.dtype.itemsize * len(data)
+        elif dtype.kind in 'biufM':
+            layout.append((column, dtype.str, None, offset))
+            offset += dtype.itemsize * len(data)
+        else:
+            raise TypeError(f"Column {column!r} has dtype {dtype}, which cannot be shared; load it as a category")
+    layout.append((_ROW, np.dtype('int64').str, None, offset))
+    return layout, offset + 8 * len(data)
+
+
+# Column arrays of a shared block, as views into its buffer
+def _arrays(block, layout, rows):
+    return {column: np.ndarray(rows, dtype=dtype, buffer=block.buf, offset=offset)
+            for column, dtype, _, offset in layout}
+
+
+# Shared blocks this worker process has attached to. They stay open until the process
+# exits, so tasks can work on views of their rows rather than on copies.
+_attached = {}
+
+
+def _attach(handle):
+    name, layout, rows = handle
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return _arrays(_attached[name], layout, rows)
+
+
+# Rows [start, stop) of a shared block as a DataFrame of views into it, optionally only
+# the given columns. Pipeline steps replace the columns they change, never writing into them.
+def _read(handle, start, stop, names=None):
+    arrays = _attach(handle)
+    columns = {}
+    for column, _, categories, _ in handle[1]:
+        if names is not None and column not in names:
+            continue
+        values = arrays[column][start:stop]
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, dtype=categories, validate=False)
+        columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+# Write `data` into a shared block from row `start` on, skipping the columns that still
+# are the views _read() gave for those rows
+def _write(handle, start, data):
+    arrays = _attach(handle)
+    for column, dtype, categories, _ in handle[1]:
+        values = (data[column].cat.codes if categories is not None else data[column]).to_numpy(dtype=dtype)
+        target = arrays[column][start:start + len(data)]
+        if values.ctypes.data != target.ctypes.data:
+            target[:] = values
+
+
+# Write the rows of `data` at the positions `order` into a shared block, each column
+# taken straight into its place, along with those positions
+def _share(block, layout, data, order):
+    arrays = _arrays(block, layout, len(order))
+    for column, _, categories, _ in layout:
+        if column == _ROW:
+            arrays[column][:] = order
+            continue
+        values = data[column].cat.codes if categories is not None else data[column]
+        # mode='clip' takes into `out` directly, the default mode through a temporary copy
+        np.take(values.to_numpy(), order, out=arrays[column], mode='clip')
+
+
+# The rows at `positions` of a shared block as a DataFrame, without the row positions
+def _gather(block, layout, rows, positions):
+    arrays = _arrays(block, layout, rows)
+    columns = {}
+    for column, _, categories, _ in layout[:-1]:
+        values = arrays[column].take(positions)
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, dtype=categories, validate=False)
+        columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+# `positions` in the order of the serial pipeline's result: sorted by SORT_COLUMNS (as
+# their codes for categories, missing ones last), ties in their original row order.
+# Dates are never missing at this point, rows without one have been dropped.
+def _serial_order(block, layout, rows, positions):
+    arrays = _arrays(block, layout, rows)
+    categorical = {column: categories is not None for column, _, categories, _ in layout}
+    keys = [arrays[_ROW][positions]]
+    for column in reversed(SORT_COLUMNS):
+        values = arrays[column][positions].astype('int64')
+        if categorical[column]:
+            values[values < 0] = np.iinfo('int64').max
+        keys.append(values)
+    return positions[np.lexsort(keys)]
+
+
+def _shard_keys(data, shard_by):
+    if shard_by == 'State':
+        return data['State'].cat.codes.to_numpy()
+    if shard_by == 'year':
+        return data['Date Local'].dt.year.fillna(-1).to_numpy(dtype='int64')
+    raise ValueError(f"shard_by must be one of {SHARD_KEYS}, got {shard_by!r}")
+
+
+# Order of the rows grouped by shard, original order kept within a shard, and the
+# [start, stop) range of each shard in that order. Missing keys (-1) form the last shard.
+def _shards(data, shard_by):
+    keys = _shard_keys(data, shard_by)
+    keys = np.where(keys < 0, keys.max(initial=0) + 1, keys)
+    order = np.argsort(keys, kind='stable')
+    bounds = np.flatnonzero(np.diff(keys[order])) + 1
+    starts = np.concatenate([[0], bounds]) if len(order) else np.array([], dtype='int64')
+    stops = np.concatenate([bounds, [len(order)]]) if len(order) else np.array([], dtype='int64')
+    return order, list(zip(starts.tolist(), stops.tolist()))
+
+
+# Collapse the shard's site-days into the output block, then return the medians of the
+# imputation levels whose groups all lie in the shard (with `local`)
+def _collapse(shard, handle, output, local):
+    start, stop = shard
+    shard, report = collapse_site_days(_read(handle, start, stop))
+    _write(output, start, shard)
+    if not local:
+        return report, {}
+    medians = imputation_medians(shard)
+    del medians[GLOBAL_LEVEL]
+    return report, medians
+
+
+# imputation_medians() of some columns over the rows [start, stop) of every shard: over
+# the whole columns, and per group of the given imputation levels
+def _column_medians(columns, output, shards, levels):
+    keys = list(dict.fromkeys(key for level in levels for key in IMPUTATION_LEVELS[level]))
+    data = pd.concat([_read(output, start, stop, keys + columns) for start, stop in shards], ignore_index=True)
+    return imputation_medians(data, columns)
+
+
+def _impute(shard, output, medians):
+    start, stop = shard
+    shard, report = fill_medians(_read(output, start, stop), medians)
+    shard = shard.dropna(subset=['Date Local'])
+    _write(output, start, shard)
+    return len(shard), report, {column: QuantileSketch(0).update(shard[column]) for column in POLLUTANT_AQI_COLUMNS}
+
+
+def _clean(shard, output, bounds):
+    start, _ = shard
+    shard = _read(output, *shard)
+    replace_outliers_with_median(shard, POLLUTANT_AQI_COLUMNS, bounds=bounds)
+    _write(output, start, shard.sort_values(SORT_COLUMNS, kind='stable'))
+
+
+def _merge(sketches):
+    merged = {}
+    for shard in sketches:
+        for column, sketch in shard.items():
+            merged.setdefault(column, QuantileSketch(0)).merge(sketch)
+    return merged
+
+
+# Medians of every imputed column: those of the levels computed per shard, and those
+# spanning shards from _column_medians() tasks, one per worker. Each task groups its rows
+# once for all of its columns, so the work adds up to about that of the serial pipeline.
+def _imputation_medians(pool, workers, output, shards, local, columns):
+    levels = [] if local else list(IMPUTATION_LEVELS)
+    batches = [columns[i::workers] for i in range(min(workers, len(columns)))]
+    tables = list(pool.map(_column_medians, batches, [output] * len(batches), [shards] * len(batches),
+                           [levels] * len(batches)))
+    medians = {level: pd.concat([table[level] for table in tables], axis=1)[columns] for level in levels}
+    for level in local[0] if local else ():
+        medians[level] = pd.concat([shard[level] for shard in local])
+    medians[GLOBAL_LEVEL] = pd.concat([table[GLOBAL_LEVEL] for table in tables])[columns]
+    return medians
+
+
+# function(shard, *args) for every (start, stop) shard, results in shard order
+def _map(pool, function, shards, *args):
+    # Largest shards first, so the pool is not left waiting on one big shard at the end
+    order = sorted(range(len(shards)), key=lambda i: shards[i][1] - shards[i][0], reverse=True)
+    futures = {i: pool.submit(function, shards[i], *args) for i in order}
+    return [futures[i].result() for i in range(len(shards))]
+
+
+# pipeline.preprocess() split by State or by year over `workers` processes (default:
+# one per CPU). The result is identical to the serial one, row order included.
+def preprocess_parallel(data, workers=None, shard_by='State'):
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"shard_by must be one of {SHARD_KEYS}, got {shard_by!r}")
+    if data.empty:
+        # No shards to spread
+        return preprocess(data.copy())
+    data = data.reset_index(drop=True)
+    order, shards = _shards(data, shard_by)
+    layout, size = _layout(data)
+    source = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    target = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        handle = (source.name, layout, len(data))
+        output = (target.name, layout, len(data))
+        with span('share', rows=len(data)):
+            _share(source, layout, data, order)
+            del data
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            with span('collapse_site_days') as record:
+                # Every imputation level is keyed by State first
+                statistics = _map(pool, _collapse, shards, handle, output, shard_by == 'State')
+                record['rows_removed'] = sum(report['rows_removed'] for report, _ in statistics)
+            collapsed = [(start, start + report['rows_out']) for (start, _), (report, _) in zip(shards, statistics)]
+            with span('imputation_medians'):
+                local = [tables for _, tables in statistics] if shard_by == 'State' else None
+                columns = [column for column in IMPUTED_COLUMNS if column in [name for name, *_ in layout]]
+                medians = _imputation_medians(pool, workers, output, collapsed, local, columns)
+            with span('impute') as record:
+                imputed = _map(pool, _impute, collapsed, output, medians)
+                bounds = bounds_from_sketches(_merge(sketches for _, _, sketches in imputed))
+                report = sum(report for _, report, _ in imputed)
+                record['filled'] = {level: int(count) for level, count in report.drop(columns='unfilled').sum().items()}
+            cleaned = [(start, start + rows) for (start, _), (rows, _, _) in zip(shards, imputed)]
+            with span('replace_outliers'):
+                _map(pool, _clean, cleaned, output, bounds)
+        with span('merge'):
+            positions = np.concatenate([np.arange(start, stop) for start, stop in cleaned])
+            if shard_by != 'State':
+                # State shards are disjoint and already in State order; others interleave
+                positions = _serial_order(target, layout, len(order), positions)
+            return _gather(target, layout, len(order), positions)
+    finally:
+        for block in (source, target):
+            block.close()
+            block.unlink()
@@ -0,0 +1,286 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import CACHE_DIR, artifact_name, cached_frame, fingerprint, make_key
+from data_preprocessing import (DISCRETE_COLUMNS, INCREMENTAL_PATH, MEASURE_COLUMNS, POLLUTANT_AQI_COLUMNS, RAW_DATA_PATH,
+                                SITE_COLUMNS, STORE_PATH, compact, load_data, load_store)
+from outliers import replace_outliers_with_median
+from profiling import span
+from sketches import DEFAULT_RELATIVE_ACCURACY, QuantileSketch
+
+# Bump when the cleaning rules change in a way the code hash below would not catch
+PIPELINE_VERSION = "4"
+
+# Modules whose source is part of the cache key, so editing them invalidates cached artifacts
+PIPELINE_MODULES = ['data_preprocessing.py', 'incremental.py', 'outliers.py', 'pipeline.py', 'parallel.py', 'sketches.py',
+                    'streaming.py']
+
+# Pollutants the EPA export reports at several sampling durations, one row per combination
+MULTI_DURATION_POLLUTANTS = ['SO2', 'CO']
+SITE_DAY_COLUMNS = SITE_COLUMNS + ['Date Local']
+IMPUTED_COLUMNS = MEASURE_COLUMNS
+# Missing values take the median of the row's City, else of its County, else of its State,
+# else of the whole column. City and County names are only unique within a State.
+IMPUTATION_LEVELS = {'City': ['State', 'City'], 'County': ['State', 'County'], 'State': ['State']}
+GLOBAL_LEVEL = 'global'
+SORT_COLUMNS = ['State', 'City', 'Date Local']
+
+
+# One row per (site, Date Local). The export repeats a site-day once per combination of
+# SO2 and CO sampling durations (up to four rows with the same NO2 and O3 values), and
+# only the duration the AQI is defined on (SO2 1-hour, CO 8-hour) carries an AQI.
+# The rule: keep the first row of each site-day, and take the SO2 and CO columns from
+# the first row of the site-day with that pollutant's AQI, or from the first row when
+# none has one. Rows without a date are kept as they are. Returns the data, in the order
+# of the kept rows, and a report of the rows removed.
+def collapse_site_days(data):
+    rows_in = len(data)
+    if not all(column in data.columns for column in SITE_DAY_COLUMNS):
+        return data, {'rows_in': rows_in, 'rows_out': rows_in, 'rows_removed': 0}
+    codes = data.groupby(SITE_DAY_COLUMNS, observed=True, sort=False).ngroup().fillna(-1).to_numpy(dtype='int64')
+    positions = np.arange(rows_in)
+    dated = codes >= 0
+    _, first = np.unique(codes[dated], return_index=True)
+    first = positions[dated][first]
+    kept = np.sort(np.concatenate([first, positions[~dated]]))
+    kept_codes = codes[kept]
+    result = data.take(kept)
+    for pollutant in MULTI_DURATION_POLLUTANTS:
+        aqi = f'{pollutant} AQI'
+        columns = [column for column in data.columns if column.startswith(f'{pollutant} ')]
+        if aqi not in data.columns:
+            continue
+        with_aqi = dated & data[aqi].notna().to_numpy()
+        groups, rows = np.unique(codes[with_aqi], return_index=True)
+        source = first.copy()
+        source[groups] = positions[with_aqi][rows]
+        source = np.where(kept_codes >= 0, np.append(source, 0)[kept_codes], kept)
+        for column in columns:
+            result[column] = data[column].take(source).set_axis(result.index)
+    return result, {'rows_in': rows_in, 'rows_out': len(result), 'rows_removed': rows_in - len(result)}
+
+
+# The imputed columns and the imputation levels whose keys are present in `data`
+def imputed_columns(data, columns=IMPUTED_COLUMNS):
+    return [column for column in columns if column in data.columns]
+
+
+def imputation_levels(data):
+    return {level: keys for level, keys in IMPUTATION_LEVELS.items() if all(key in data.columns for key in keys)}
+
+
+def _object_index(index):
+    # Group keys as plain labels, so tables built from categoricals, chunks or sketches line up
+    if isinstance(index, pd.MultiIndex):
+        return pd.MultiIndex.from_arrays([index.get_level_values(i).astype(object) for i in range(index.nlevels)],
+                                         names=index.names)
+    return index.astype(object)
+
+
+# Relative accuracy of the sketches of `column`. DISCRETE_COLUMNS take a few hundred
+# distinct values at most, so exact value counts of them stay small and are always kept;
+# `relative_accuracy` applies to the continuous columns, whose exact value counts grow
+# with the number of rows.
+def sketch_accuracy(column, relative_accuracy):
+    return 0 if column in DISCRETE_COLUMNS else relative_accuracy
+
+
+# Quantile sketches of every column per group of each imputation level and of the whole
+# columns, {level: {column: sketch}}. Sketches of chunks or shards can be merged with
+# merge_imputation_sketches() and turned into the imputation_medians() tables.
+def imputation_sketches(data, columns=IMPUTED_COLUMNS, relative_accuracy=0):
+    columns = imputed_columns(data, columns)
+    levels = {**imputation_levels(data), GLOBAL_LEVEL: None}
+    return {level: {column: QuantileSketch(sketch_accuracy(column, relative_accuracy)).update(
+                        data[column], None if keys is None else data[keys])
+                    for column in columns}
+            for level, keys in levels.items()}
+
+
+def merge_imputation_sketches(total, sketches):
+    if total is None:
+        return sketches
+    for level, columns in sketches.items():
+        for column, sketch in columns.items():
+            total[level][column].merge(sketch)
+    return total
+
+
+def medians_from_sketches(sketches):
+    medians = {}
+    for level, columns in sketches.items():
+        if level == GLOBAL_LEVEL:
+            medians[level] = pd.Series({column: sketch.quantile(0.5) for column, sketch in columns.items()},
+                                       index=list(columns), dtype='float64')
+        else:
+            # Columns without any value have no groups, and no medians
+            table = pd.DataFrame({column: sketch.quantile(0.5) for column, sketch in columns.items() if sketch.count()},
+                                 columns=list(columns))
+            table.index = _object_index(table.index)
+            medians[level] = table
+    return medians
+
+
+# Medians of every column per group of each imputation level, from one grouped pass per
+# level, plus the medians of the whole columns: {level: DataFrame by the level's keys,
+# GLOBAL_LEVEL: Series}. Exact, or from quantile sketches within `relative_accuracy`.
+def imputation_medians(data, columns=IMPUTED_COLUMNS, relative_accuracy=None):
+    if relative_accuracy is not None:
+        return medians_from_sketches(imputation_sketches(data, columns, relative_accuracy))
+    columns = imputed_columns(data, columns)
+    medians = {}
+    for level, keys in imputation_levels(data).items():
+        table = data.groupby(keys, observed=True)[columns].median()
+        table.index = _object_index(table.index)
+        medians[level] = table
+    medians[GLOBAL_LEVEL] = data[columns].median()
+    return medians
+
+
+# Position in `table` of each row's group, -1 for rows without a group in the table or
+# with a missing key. Keys are looked up once per distinct group, not once per row.
+def _group_positions(data, keys, table):
+    groups = data.groupby(keys, observed=True, sort=False)
+    codes = groups.ngroup().fillna(-1).to_numpy(dtype='int64')
+    positions = table.index.get_indexer(_object_index(groups.size().index))
+    return np.append(positions, -1)[codes]
+
+
+# Fill missing values level by level from imputation_medians() tables. Returns the data and
+# a report of how many values each level filled per column ('unfilled': still missing).
+def fill_medians(data, medians):
+    columns = [column for column in medians[GLOBAL_LEVEL].index if column in data.columns]
+    missing = {column: data[column].isna().to_numpy(copy=True) for column in columns}
+    report = pd.DataFrame(0, index=pd.Index(columns, name='column'),
+                          columns=[*IMPUTATION_LEVELS, GLOBAL_LEVEL, 'unfilled'], dtype='int64')
+    levels = [(level, medians[level]) for level in IMPUTATION_LEVELS if level in medians]
+    for level, table in levels + [(GLOBAL_LEVEL, None)]:
+        if not any(mask.any() for mask in missing.values()):
+            break
+        positions = None if table is None else _group_positions(data, IMPUTATION_LEVELS[level], table)
+        for column in columns:
+            if not missing[column].any():
+                continue
+            if table is None:
+                fill = np.full(len(data), medians[GLOBAL_LEVEL][column])
+            else:
+                values = np.append(table[column].to_numpy(dtype='float64'), np.nan)
+                fill = values[positions]
+            fill = fill.astype(data[column].dtype)
+            filled = missing[column] & ~np.isnan(fill)
+            data[column] = data[column].mask(filled, pd.Series(fill, index=data.index))
+            missing[column] &= ~filled
+            report.loc[column, level] = filled.sum()
+    for column in columns:
+        report.loc[column, 'unfilled'] = missing[column].sum()
+    return data, report
+
+
+# Fill missing values of every measure column, falling back from City to County to State
+# to the whole column. Returns the data and the fill report of fill_medians().
+def impute_medians(data, columns=IMPUTED_COLUMNS, relative_accuracy=None):
+    return fill_medians(data, imputation_medians(data, columns, relative_accuracy))
+
+
+# The full cleaning pipeline shared by every dashboard. The result is sorted by
+# (State, City, Date Local), which data_index.LocationIndex relies on.
+# relative_accuracy switches the medians and IQR bounds to quantile sketches.
+def preprocess(data, relative_accuracy=None):
+    with span('collapse_site_days', rows=len(data)) as record:
+        data, report = collapse_site_days(data)
+        record['rows_removed'] = report['rows_removed']
+    with span('impute', rows=len(data)) as record:
+        data, report = impute_medians(data, relative_accuracy=relative_accuracy)
+        record['filled'] = {level: int(count) for level, count in report.drop(columns='unfilled').sum().items()}
+    with span('drop_bad_dates', rows=len(data)):
+        data = data.dropna(subset=['Date Local'])
+    with span('replace_outliers', rows=len(data)):
+        replace_outliers_with_median(data, POLLUTANT_AQI_COLUMNS, relative_accuracy=relative_accuracy)
+    with span('sort', rows=len(data)):
+        return data.sort_values(SORT_COLUMNS, kind='stable', ignore_index=True)
+
+
+# The incremental dataset once `ingest.py --append` has built it, else the store, else the CSV
+def default_source():
+    for path in (INCREMENTAL_PATH, STORE_PATH):
+        if os.path.isdir(path):
+            return path
+    return RAW_DATA_PATH
+
+
+def code_fingerprint(modules=PIPELINE_MODULES):
+    here = os.path.dirname(os.path.abspath(__file__))
+    return make_key(*(fingerprint(os.path.join(here, module)) for module in modules))
+
+
+# Cache key of the cleaned dataset: source content + pipeline version + pipeline code
+def dataset_version(source=None, columns=None):
+    source = source or default_source()
+    return make_key(fingerprint(source), PIPELINE_VERSION, code_fingerprint(), columns)
+
+
+# Cleaned dataset, preprocessed once per dataset version and cached in memory and on disk.
+# The returned frame is shared between sessions and must not be modified: it is mapped
+# from the Arrow file of the disk cache, one read-only copy for every session and process.
+# With `memory_limit` (bytes) the cleaning runs chunk by chunk within that budget, the
+# medians filling continuous columns within 1% (see streaming.py); that result is cached
+# apart from the exact one, so later loads without a limit never get it. With `workers`
+# > 1 it is sharded by State over that many processes, with the same result as the
+# serial run. The cached frame is compacted to the smallest dtypes holding its values.
+def load_clean_data(source=None, columns=None, memory_limit=None, workers=None):
+    source = source or default_source()
+
+    def clean():
+        # Imported here, incremental builds on this module
+        from incremental import is_incremental, load_incremental
+
+        if is_incremental(source):
+            # Cleaned as it was appended, only read back
+            with span('load') as record:
+                data = load_incremental(source, columns)
+                record['rows'] = len(data)
+            return data
+        if memory_limit is not None:
+            # Imported here, streaming builds on this module
+            from streaming import stream_preprocess
+
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Written under the lock of the cached frame, so one process at a time uses it
+            path = os.path.join(CACHE_DIR, f"{artifact_name('clean_data-stream', columns)}.parquet")
+            try:
+                stream_preprocess(source, path, memory_limit=memory_limit, columns=columns,
+                                  relative_accuracy=DEFAULT_RELATIVE_ACCURACY)
+                return load_store(path)
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
+        with span('load') as record:
+            if os.path.isdir(source):
+                data = load_data(columns=columns, store_path=source)
+            else:
+                data = load_data(columns=columns, store_path=None, raw_path=source)
+            record['rows'] = len(data)
+        if workers is not None and workers > 1:
+            # Imported here, parallel builds on this module
+            from parallel import preprocess_parallel
+
+            return preprocess_parallel(data, workers)
+        return preprocess(data)
+
+    def build():
+        data = clean()
+        with span('compact', rows=len(data)) as record:
+            before = data.memory_usage(deep=True).sum()
+            data = compact(data)
+            record['bytes_saved'] = int(before - data.memory_usage(deep=True).sum())
+        return data
+
+    name, version = 'clean_data', dataset_version(source, columns)
+    if memory_limit is not None:
+        name, version = 'clean_data-stream', make_key(version, DEFAULT_RELATIVE_ACCURACY)
+    with span('clean_data') as record:
+        data = cached_frame(artifact_name(name, columns), version, build)
+        record['rows'] = len(data)
+    return data
@@ -0,0 +1,82 @@
+import contextvars
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:  # memory deltas are left empty without psutil
+    psutil = None
+
+# Spans of every profiled rerun are appended here, one JSON object per line
+PROFILE_LOG_PATH = "profile.jsonl"
+
+# Profiler of the rerun running in the current thread, if profiling is on
+_active = contextvars.ContextVar('profiler', default=None)
+
+
+def _rss():
+    return psutil.Process().memory_info().rss if psutil is not None else None
+
+
+# Spans of one run of a page: wall time, CPU time of the running thread, resident
+# memory delta and rows processed of each named section, nested spans included
+class Profiler:
+    def __init__(self, page):
+        self.page = page
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.spans = []
+        self._depth = 0
+
+    # Time the enclosed block. The yielded record can be annotated, e.g. record['rows'] = len(data)
+    @contextmanager
+    def span(self, name, rows=None):
+        record = {'name': name, 'depth': self._depth, 'rows': rows}
+        self.spans.append(record)
+        self._depth += 1
+        rss = _rss()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.thread_time() - cpu
+            record['memory_delta_bytes'] = _rss() - rss if rss is not None else None
+            self._depth -= 1
+
+    def records(self):
+        return [{'run_id': self.run_id, 'page': self.page, 'timestamp': self.started, **span} for span in self.spans]
+
+    def to_jsonl(self):
+        return ''.join(json.dumps(record) + '\n' for record in self.records())
+
+    def write(self, path=PROFILE_LOG_PATH):
+        with open(path, 'a') as handle:
+            handle.write(self.to_jsonl())
+
+
+# Start profiling a run of `page` in this thread, or switch profiling off with enabled=False.
+# Returns the profiler, or None when disabled.
+def start_profiling(page, enabled=True):
+    profiler = Profiler(page) if enabled else None
+    _active.set(profiler)
+    return profiler
+
+
+def stop_profiling():
+    _active.set(None)
+
+
+# Span of the active profiler, or a no-op when profiling is off. Library code wraps its
+# stages in this so the dashboards can see inside them without passing a profiler around.
+@contextmanager
+def span(name, rows=None):
+    profiler = _active.get()
+    if profiler is None:
+        yield {}
+        return
+    with profiler.span(name, rows) as record:
+        yield record
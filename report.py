@@ -0,0 +1,168 @@
+import argparse
+import html
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import plotly.graph_objects as go
+
+import charts
+from analytics import BACKENDS, DEFAULT_BACKEND, load_dashboard, state_means
+from visualization import figure_png
+
+# Render the dashboard panels of main.py and new.py to files, without a Streamlit
+# server: PNG for the matplotlib charts, standalone HTML for the Plotly ones, and an
+# index.html linking them all. The dataset, its cube and its index are loaded once by
+# the parent process; the render processes inherit them when forked, or load them from
+# the disk cache otherwise, and each renders one panel per task.
+DEFAULT_REPORT_PATH = 'report'
+POLLUTANTS = ['NO2', 'O3', 'SO2', 'CO']
+DEFAULT_CITIES_PER_STATE = 3
+# States drawn together in a State trends panel, as allowed by main.py
+TREND_STATES = 5
+
+# Dashboard of the render process, set by _load()
+_dashboard = None
+
+
+def _load(source, backend):
+    global _dashboard
+    _dashboard = load_dashboard(source, backend=backend)
+
+
+def _slug(*parts):
+    return re.sub(r'[^A-Za-z0-9]+', '-', '-'.join(str(part) for part in parts)).strip('-').lower()
+
+
+# One panel per task: (section, title, file name without extension, charts function,
+# 'cube' or 'index' as its first argument, remaining arguments)
+def report_tasks(dashboard, pollutants=POLLUTANTS, states=None, cities_per_state=DEFAULT_CITIES_PER_STATE,
+                 start=None, end=None):
+    cube, index = dashboard.cube, dashboard.index
+    start = pd.Timestamp(index.min_date if start is None else start)
+    end = pd.Timestamp(index.max_date if end is None else end)
+    states = index.states(start, end) if states is None else states
+    tasks = [
+        ('Overview', "Top pollutant level States", 'top-states', 'top_states_figure', 'cube', ()),
+        ('Overview', "Pollutant correlations", 'correlation', 'correlation_figure', 'cube', ()),
+        ('Overview', "Seasonal trends of pollutants", 'seasonal', 'seasonal_figure', 'cube', ()),
+        ('Overview', "Average AQI levels by State and pollutant", 'aqi-heatmap', 'aqi_heatmap_figure', 'cube', ()),
+        ('Overview', "Average AQI levels by pollutant", 'aqi-bar', 'aqi_bar_figure', 'cube', ()),
+    ]
+    for pollutant in pollutants:
+        mean, aqi = f'{pollutant} Mean', f'{pollutant} AQI'
+        section = f'{pollutant} by State and over time'
+        top = state_means(cube, [aqi])[aqi].nlargest(TREND_STATES).index.tolist()
+        tasks += [
+            (section, f"Trend of {mean}", _slug('trend', mean), 'trend_figure', 'cube', (mean, start, end)),
+            (section, f"Daily trend of {mean}", _slug('daily-trend', mean), 'daily_trend_figure', 'cube', (mean, start, end)),
+            (section, f"Map of {mean} by State", _slug('map', mean), 'state_map_figure', 'cube', (mean,)),
+            (section, f"Heatmap of {aqi} across States", _slug('heatmap', aqi), 'state_heatmap_figure', 'cube', (aqi,)),
+            (section, f"Top 10 States by {aqi}", _slug('top-states', aqi), 'top_states_bar_figure', 'cube', (aqi,)),
+            (section, f"Average {aqi} by State", _slug('states', aqi), 'state_bar_figure', 'cube', (aqi,)),
+            (section, f"Trends of {aqi} in {', '.join(top)}", _slug('state-trends', aqi), 'state_trends_figure', 'cube',
+             (top, aqi)),
+        ]
+    for state in states:
+        for city in index.largest_cities(state, cities_per_state, start, end):
+            section = f'Cities of {state}'
+            tasks += [
+                (section, f"AQI levels and peak values in {city}", _slug('city', state, city), 'city_figure', 'cube',
+                 (state, city, start, end)),
+                (section, f"AQI levels in {city}", _slug('city-aqi', state, city), 'city_aqi_figure', 'cube',
+                 (state, city, start, end)),
+            ]
+    return tasks
+
+
+# Render one task into `out`, returning its file name, or the error that prevented it
+def _render(task, out):
+    _, _, name, chart, argument, args = task
+    try:
+        figure = getattr(charts, chart)(getattr(_dashboard, argument), *args)
+        if isinstance(figure, go.Figure):
+            name += '.html'
+            figure.write_html(os.path.join(out, name), include_plotlyjs='cdn')
+        else:
+            name += '.png'
+            with open(os.path.join(out, name), 'wb') as file:
+                file.write(figure_png(figure))
+        return name, None
+    except Exception as error:
+        return None, f"{type(error).__name__}: {error}"
+
+
+def _write_index(out, tasks, results, title):
+    lines = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8">', f'<title>{html.escape(title)}</title>',
+             '<style>body{font-family:sans-serif;margin:2em} img{max-width:100%} '
+             'iframe{width:100%;height:520px;border:0}</style>', '</head><body>', f'<h1>{html.escape(title)}</h1>']
+    section = None
+    for (task_section, task_title, *_), (name, error) in zip(tasks, results):
+        if task_section != section:
+            section = task_section
+            lines.append(f'<h2>{html.escape(section)}</h2>')
+        lines.append(f'<h3>{html.escape(task_title)}</h3>')
+        if error is not None:
+            lines.append(f'<p><em>Not rendered: {html.escape(error)}</em></p>')
+        elif name.endswith('.html'):
+            lines.append(f'<iframe src="{html.escape(name)}" loading="lazy"></iframe>')
+        else:
+            lines.append(f'<img src="{html.escape(name)}" alt="{html.escape(task_title)}" loading="lazy">')
+    lines.append('</body></html>')
+    path = os.path.join(out, 'index.html')
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines))
+    return path
+
+
+# Render every panel of report_tasks() into `out` over `workers` processes (default: one
+# per CPU, 1 renders in this process). Returns [(task, file name, error)].
+def render_report(out=DEFAULT_REPORT_PATH, source=None, workers=None, backend=None, **selection):
+    backend = backend or DEFAULT_BACKEND
+    dashboard = load_dashboard(source, workers=workers, backend=backend)
+    tasks = report_tasks(dashboard, **selection)
+    os.makedirs(out, exist_ok=True)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _load(source, backend)
+        results = [_render(task, out) for task in tasks]
+    else:
+        # DuckDB connections do not survive a fork, so the SQL backend starts fresh processes
+        context = multiprocessing.get_context('spawn') if backend == 'sql' else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_load,
+                                 initargs=(source, backend)) as pool:
+            results = list(pool.map(_render, tasks, [out] * len(tasks)))
+    _write_index(out, tasks, results, "Air Quality Analysis Report")
+    return [(task, name, error) for task, (name, error) in zip(tasks, results)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the dashboard panels to PNG and HTML files with an index page.")
+    parser.add_argument('source', nargs='?', help="dataset to report on (default: the dashboards' dataset)")
+    parser.add_argument('--out', default=DEFAULT_REPORT_PATH, help=f"output directory (default {DEFAULT_REPORT_PATH})")
+    parser.add_argument('--workers', type=int, help="render processes (default: one per CPU)")
+    parser.add_argument('--backend', choices=BACKENDS, help="dashboard backend (default: POLLUTION_BACKEND or pandas)")
+    parser.add_argument('--pollutants', nargs='+', choices=POLLUTANTS, default=POLLUTANTS, help="pollutants to report on")
+    parser.add_argument('--states', nargs='+', help="States whose cities are reported on (default: all)")
+    parser.add_argument('--cities-per-state', type=int, default=DEFAULT_CITIES_PER_STATE,
+                        help="cities per State, those with the most measurements first")
+    parser.add_argument('--start', help="first date of the trends, e.g. 2010-01-01 (default: first date of the data)")
+    parser.add_argument('--end', help="last date of the trends (default: last date of the data)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = render_report(args.out, args.source, workers=args.workers, backend=args.backend,
+                            pollutants=args.pollutants, states=args.states, cities_per_state=args.cities_per_state,
+                            start=args.start, end=args.end)
+    failed = [(task, error) for task, _, error in results if error is not None]
+    print(f"Rendered {len(results) - len(failed)} panels to {os.path.join(args.out, 'index.html')} "
+          f"in {time.perf_counter() - start:.1f}s")
+    for task, error in failed:
+        print(f"Failed {task[1]}: {error}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,24 @@
+import functools
+
+import streamlit as st
+
+from profiling import span
+
+
+# Declare an independently rerunnable dashboard section. The section runs as a
+# Streamlit fragment: a change to a widget created inside it reruns only this section,
+# not the whole page. Values from the sidebar are passed as arguments (a sidebar change
+# reruns the page anyway). A section reading a widget of another section is called from
+# inside that section with the widget's value as an argument: it then reruns along with
+# the section owning the widget, and alone when its own widgets change.
+def section(name):
+    def decorate(body):
+        @st.fragment
+        @functools.wraps(body)
+        def run(*args, **kwargs):
+            # The section's charts are grouped under its name in the profile of a page rerun
+            with span(name):
+                return body(*args, **kwargs)
+        return run
+
+    return decorate
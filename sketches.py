@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+# Mergeable quantile sketch with a relative error bound (the DDSketch bucketing scheme).
+#
+# Every value is rounded to the centre of a logarithmic bucket (gamma^(k-1), gamma^k]
+# with gamma = (1 + a) / (1 - a), and only per-bucket counts are kept. Any quantile read
+# from the sketch is then within a relative error `a` (relative_accuracy) of the exact
+# quantile, and the sketch holds at most about log(max / min) / log(gamma) buckets per
+# group whatever the number of rows: about 700 buckets at a = 0.01 for values between
+# 0.001 and 1000. Values smaller than MIN_VALUE in magnitude are counted as 0.
+#
+# relative_accuracy=0 keeps exact value counts instead: quantiles are then identical to
+# DataFrame.quantile(), and memory grows with the number of distinct values (small for
+# the integer AQI columns, large for the continuous Mean columns).
+DEFAULT_RELATIVE_ACCURACY = 0.01
+MIN_VALUE = 1e-9
+
+
+def _lerp(low, high, fraction):
+    # Same interpolation as numpy's linear quantile, so exact results match DataFrame.quantile
+    return np.where(fraction >= 0.5, high - (high - low) * (1 - fraction), low + (high - low) * fraction)
+
+
+# Quantiles from value counts. `counts` is indexed by value, or by (*group keys, value)
+# for per-group quantiles; the result has one entry per quantile (and one row per group).
+def quantiles_from_counts(counts, quantiles):
+    grouped = isinstance(counts.index, pd.MultiIndex)
+    if not grouped:
+        counts = pd.Series(counts.to_numpy(), index=pd.MultiIndex.from_arrays([np.zeros(len(counts), dtype='int64'), counts.index]))
+    counts = counts[counts > 0].sort_index()
+    levels = list(range(counts.index.nlevels - 1))
+    keys = counts.index.droplevel(-1)
+    values = counts.index.get_level_values(-1).to_numpy(dtype='float64')
+    stop = counts.groupby(level=levels, sort=False).cumsum().to_numpy()
+    start = stop - counts.to_numpy()
+    total = counts.groupby(level=levels, sort=False).transform('sum').to_numpy()
+
+    result = {}
+    for quantile in quantiles:
+        position = (total - 1) * quantile
+        low, high = np.floor(position), np.ceil(position)
+        # Each group has exactly one value covering its low and one covering its high position
+        at_low = (start <= low) & (low < stop)
+        at_high = (start <= high) & (high < stop)
+        result[quantile] = pd.Series(_lerp(values[at_low], values[at_high], (position - low)[at_low]), index=keys[at_low])
+    result = pd.DataFrame(result, columns=list(quantiles))
+    if grouped:
+        return result
+    return result.iloc[0] if len(result) else pd.Series(np.nan, index=list(quantiles))
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if not 0 <= relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy must be in [0, 1), got {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        # Counts per rounded value, indexed by value or by (group, value)
+        self.counts = None
+
+    def _round(self, values):
+        if self.relative_accuracy == 0:
+            return values
+        gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        magnitude = np.abs(values)
+        with np.errstate(divide='ignore'):
+            bucket = np.ceil(np.log(np.maximum(magnitude, MIN_VALUE)) / np.log(gamma))
+        rounded = np.sign(values) * 2 * gamma ** bucket / (gamma + 1)
+        rounded[magnitude < MIN_VALUE] = 0.0
+        return rounded
+
+    def _add(self, counts):
+        self.counts = counts if self.counts is None else self.counts.add(counts, fill_value=0)
+        return self
+
+    # Add a batch of values, optionally with the group of each value: one key (e.g. the
+    # City column) or several (a DataFrame, e.g. the State and City columns)
+    def update(self, values, groups=None):
+        values = pd.Series(values).astype('float64')
+        present = values.notna().to_numpy()
+        rounded = self._round(values.to_numpy()[present])
+        if groups is None:
+            counts = pd.Series(rounded).value_counts()
+        else:
+            groups = groups if isinstance(groups, pd.DataFrame) else pd.DataFrame({'group': pd.Series(groups).to_numpy()})
+            keys = [groups[column].astype(object).to_numpy()[present] for column in groups.columns]
+            counts = pd.Series(rounded).groupby([*keys, rounded]).size()
+        return self._add(counts)
+
+    # Fold another sketch (e.g. of another chunk or partition) into this one
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracies")
+        if other.counts is not None:
+            self._add(other.counts)
+        return self
+
+    # Add counts[i] occurrences of values[i] to an ungrouped sketch, e.g. imputed values
+    def update_repeated(self, values, counts):
+        values = np.asarray(values, dtype='float64')
+        counts = np.asarray(counts)
+        keep = ~np.isnan(values) & (counts > 0)
+        return self._add(pd.Series(counts[keep]).groupby(self._round(values[keep])).sum())
+
+    def count(self):
+        return 0 if self.counts is None else int(self.counts.sum())
+
+    # Quantiles of all values (a Series by quantile) or per group (a DataFrame by group)
+    def quantiles(self, quantiles):
+        if self.counts is None:
+            return pd.Series(np.nan, index=list(quantiles))
+        return quantiles_from_counts(self.counts, quantiles)
+
+    def quantile(self, quantile):
+        return self.quantiles([quantile])[quantile]
+
+
+# One sketch per column of `data`, optionally grouped by the `by` column (or list of columns)
+def sketch_columns(data, columns, by=None, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    groups = None if by is None else data[by]
+    return {column: QuantileSketch(relative_accuracy).update(data[column], groups) for column in columns}
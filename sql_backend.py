@@ -0,0 +1,217 @@
+import os
+import threading
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # the SQL backend is optional, the dashboards default to pandas
+    duckdb = None
+
+from aggregates import CITY_DATE_MEASURES, CUBE_MEASURES, TREND_LEVELS, with_rolling
+from cache import cached_artifact, fingerprint, make_key
+from data_preprocessing import POLLUTANT_AQI_COLUMNS
+from pipeline import code_fingerprint
+from streaming import CLEAN_DATA_PATH
+
+# Dashboards backed by SQL queries over the cleaned parquet output of
+# `ingest.py --clean` (or a directory of parquet files), run by DuckDB inside the
+# process. Filters on State, City and Date Local are WHERE clauses that DuckDB pushes
+# down to the parquet scan, skipping row groups by their min/max statistics (the
+# cleaned file is sorted by State, City and Date Local, so these skips are effective),
+# and only aggregated results come back to Python. Nothing but small aggregates is
+# held in memory, however many years the file covers.
+#
+# SqlCube and SqlIndex stand in for the aggregate cube and the LocationIndex, so the
+# analytics functions and the dashboards work unchanged on either backend.
+SQL_MODULES = ['sql_backend.py', 'aggregates.py']
+# Rows of the dataset kept in memory as a preview, in place of the full frame
+PREVIEW_ROWS = 100
+# Last day of the period of "Date Local" at each resolution of aggregates.TREND_RESOLUTIONS
+PERIOD_ENDS = {
+    'day': 'date_trunc(\'day\', "Date Local")',
+    'week': 'date_trunc(\'week\', "Date Local") + INTERVAL 6 DAY',
+    'month': 'last_day("Date Local")::TIMESTAMP',
+    'year': 'make_timestamp(year("Date Local"), 12, 31, 0, 0, 0)',
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _placeholders(values):
+    return ', '.join('?' for _ in values)
+
+
+# One DuckDB database over the parquet data, with a `clean` view of it
+class SqlDataset:
+    def __init__(self, path=CLEAN_DATA_PATH):
+        if duckdb is None:
+            raise ImportError("The SQL backend needs the duckdb package: pip install duckdb")
+        self.path = path
+        scan = os.path.join(path, '**', '*.parquet') if os.path.isdir(path) else path
+        self._connection = duckdb.connect()
+        self._connection.execute(f"CREATE VIEW clean AS SELECT * FROM read_parquet('{scan.replace(chr(39), chr(39) * 2)}')")
+        self._cursors = threading.local()
+        self.columns = [row[0] for row in self._connection.execute("DESCRIBE clean").fetchall()]
+
+    # Result of a query as a DataFrame. Each thread (Streamlit session) gets its own cursor.
+    def query(self, sql, params=()):
+        cursor = getattr(self._cursors, 'cursor', None)
+        if cursor is None:
+            cursor = self._cursors.cursor = self._connection.cursor()
+        return cursor.execute(sql, list(params)).df()
+
+    def measures(self, columns):
+        return [column for column in columns if column in self.columns]
+
+
+# WHERE clause (and its parameters) of a State / City / date range filter
+def _where(state=None, city=None, begin=None, end=None, states=None):
+    clauses, params = [], []
+    if state is not None:
+        clauses.append('"State" = ?')
+        params.append(state)
+    if states is not None:
+        clauses.append(f'"State" IN ({_placeholders(states)})')
+        params.extend(states)
+    if city is not None:
+        clauses.append('"City" = ?')
+        params.append(city)
+    if begin is not None:
+        clauses.append('"Date Local" >= ?')
+        params.append(pd.Timestamp(begin).to_pydatetime())
+    if end is not None:
+        clauses.append('"Date Local" <= ?')
+        params.append(pd.Timestamp(end).to_pydatetime())
+    return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+# The State x Month x Pollutant table of aggregates.state_month_stats(), grouped in SQL
+def state_month_stats(dataset, measures=CUBE_MEASURES):
+    measures = dataset.measures(measures)
+    aggregates = ', '.join(
+        f'count({_quote(m)}) AS {_quote("count|" + m)}, sum({_quote(m)}::DOUBLE) AS {_quote("sum|" + m)}, '
+        f'sum({_quote(m)}::DOUBLE * {_quote(m)}) AS {_quote("sumsq|" + m)}, median({_quote(m)}::DOUBLE) AS {_quote("median|" + m)}'
+        for m in measures)
+    wide = dataset.query(f'SELECT "State", month("Date Local") AS "Month", {aggregates} FROM clean '
+                         f'WHERE "Date Local" IS NOT NULL AND "State" IS NOT NULL GROUP BY ALL')
+    wide = wide.set_index(['State', 'Month'])
+    wide.columns = pd.MultiIndex.from_tuples([tuple(column.split('|', 1)) for column in wide.columns])
+    stats = wide.stack(level=1).rename_axis(['State', 'Month', 'Pollutant'])
+    stats['mean'] = stats['sum'] / stats['count']
+    return stats[['count', 'sum', 'sumsq', 'mean', 'median']].astype({'count': 'int64'}).sort_index()
+
+
+# Per-day count and sum of each measure, as aggregates.daily_stats()
+def daily_stats(dataset, measures=CUBE_MEASURES):
+    measures = dataset.measures(measures)
+    aggregates = ', '.join(f'count({_quote(m)}) AS {_quote("count|" + m)}, sum({_quote(m)}::DOUBLE) AS {_quote("sum|" + m)}'
+                           for m in measures)
+    daily = dataset.query(f'SELECT "Date Local", {aggregates} FROM clean GROUP BY ALL ORDER BY "Date Local"')
+    daily = daily.set_index('Date Local')
+    daily.columns = pd.MultiIndex.from_tuples([tuple(column.split('|', 1)) for column in daily.columns])
+    return daily
+
+
+def _correlation(dataset, measures):
+    pairs = [(a, b) for i, a in enumerate(measures) for b in measures[i:]]
+    row = dataset.query('SELECT ' + ', '.join(f'corr({_quote(a)}, {_quote(b)})' for a, b in pairs) + ' FROM clean')
+    matrix = pd.DataFrame(index=measures, columns=measures, dtype='float64')
+    for (a, b), value in zip(pairs, row.iloc[0]):
+        matrix.loc[a, b] = matrix.loc[b, a] = value
+    return matrix
+
+
+# The aggregate cube of aggregates.build_cube(), built by SQL queries. Instead of the
+# City x Date table and the trend pyramid, which grow with the data, city_daily() and
+# trend_table() query one city, or the selected groups, on demand.
+class SqlCube(dict):
+    def __init__(self, dataset):
+        aqi = dataset.measures(POLLUTANT_AQI_COLUMNS)
+        medians = ', '.join(f'median({_quote(m)}::DOUBLE) AS {_quote(m)}' for m in aqi)
+        super().__init__(
+            state_month=state_month_stats(dataset),
+            daily=daily_stats(dataset),
+            state_median=dataset.query(f'SELECT "State", {medians} FROM clean WHERE "State" IS NOT NULL '
+                                       f'GROUP BY ALL ORDER BY "State"').set_index('State'),
+            correlation=_correlation(dataset, aqi),
+        )
+        self.dataset = dataset
+
+    def city_daily(self, state, city, start=None, end=None):
+        measures = self.dataset.measures(CITY_DATE_MEASURES)
+        where, params = _where(state=state, city=city, begin=start, end=end)
+        medians = ', '.join(f'median({_quote(m)}::DOUBLE) AS {_quote(m)}' for m in measures)
+        return self.dataset.query(f'SELECT "Date Local", {medians} FROM clean {where} GROUP BY ALL ORDER BY "Date Local"',
+                                  params).set_index('Date Local')
+
+    # A table of the trend pyramid, over the whole history so rolling means start as in pandas
+    def trend_table(self, level, resolution, groups=None):
+        keys = TREND_LEVELS[level]
+        measures = self.dataset.measures(CUBE_MEASURES)
+        clauses = [f'{_quote(key)} IS NOT NULL' for key in keys]
+        params = []
+        if groups is not None:
+            groups = [group if isinstance(group, tuple) else (group,) for group in groups]
+            condition = ' AND '.join(f'{_quote(key)} = ?' for key in keys)
+            clauses.append('(' + (' OR '.join(f'({condition})' for _ in groups) or 'false') + ')')
+            params = [value for group in groups for value in group]
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        selected = ''.join(f'{_quote(key)}, ' for key in keys)
+        means = ', '.join(f'avg({_quote(m)}::DOUBLE) AS {_quote(m)}' for m in measures)
+        table = self.dataset.query(f'SELECT {selected}{PERIOD_ENDS[resolution]} AS "Date Local", {means} FROM clean {where} '
+                                   f'GROUP BY ALL ORDER BY ALL', params)
+        return with_rolling(table.set_index(keys + ['Date Local']), keys)
+
+
+# The parts of data_index.LocationIndex the dashboards use, answered by SQL queries
+class SqlIndex:
+    def __init__(self, dataset):
+        self.dataset = dataset
+        bounds = dataset.query('SELECT min("Date Local") AS low, max("Date Local") AS high FROM clean')
+        self.min_date = bounds['low'].iloc[0].to_datetime64()
+        self.max_date = bounds['high'].iloc[0].to_datetime64()
+
+    # States with at least one row in the date range
+    def states(self, begin=None, end=None):
+        where, params = _where(begin=begin, end=end)
+        where = (where + ' AND' if where else 'WHERE') + ' "State" IS NOT NULL'
+        return self.dataset.query(f'SELECT DISTINCT "State" FROM clean {where} ORDER BY "State"', params)['State'].tolist()
+
+    # Cities of a State with at least one row in the date range
+    def cities(self, state, begin=None, end=None):
+        where, params = _where(state=state, begin=begin, end=end)
+        return self.dataset.query(f'SELECT DISTINCT "City" FROM clean {where} AND "City" IS NOT NULL ORDER BY "City"',
+                                  params)['City'].tolist()
+
+    # Up to `limit` cities of a State with the most rows in the date range, largest first
+    def largest_cities(self, state, limit, begin=None, end=None):
+        where, params = _where(state=state, begin=begin, end=end)
+        return self.dataset.query(f'SELECT "City" FROM clean {where} AND "City" IS NOT NULL GROUP BY ALL '
+                                  f'ORDER BY count(*) DESC, "City" LIMIT {int(limit)}', params)['City'].tolist()
+
+    # Rows of the selected States in the date range
+    def rows_for_states(self, states, begin=None, end=None):
+        if not states:
+            return self.dataset.query('SELECT * FROM clean LIMIT 0')
+        where, params = _where(states=list(states), begin=begin, end=end)
+        return self.dataset.query(f'SELECT * FROM clean {where} ORDER BY "State", "City", "Date Local"', params)
+
+
+# Dataset version of the SQL backend: the parquet content and the code querying it
+def sql_version(path=CLEAN_DATA_PATH):
+    return make_key(fingerprint(path), code_fingerprint(SQL_MODULES))
+
+
+# (preview, cube, index, version) of the dashboards over `path`, built once per version
+def load_sql(path=CLEAN_DATA_PATH):
+    version = sql_version(path)
+
+    def build():
+        dataset = SqlDataset(path)
+        preview = dataset.query(f'SELECT * FROM clean LIMIT {PREVIEW_ROWS}')
+        return preview, SqlCube(dataset), SqlIndex(dataset), version
+
+    return cached_artifact('sql_dashboard', version, build, persist=False)
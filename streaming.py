@@ -0,0 +1,184 @@
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from data_preprocessing import (CATEGORICAL_COLUMNS, CODE_COLUMNS, POLLUTANT_AQI_COLUMNS, RAW_DATA_PATH,
+                                iter_data_chunks)
+from outliers import bounds_from_sketches, replace_outliers_with_median
+from pipeline import (SITE_DAY_COLUMNS, collapse_site_days, fill_medians, imputation_levels, imputation_sketches,
+                      imputed_columns, medians_from_sketches, merge_imputation_sketches, sketch_accuracy)
+from sketches import DEFAULT_RELATIVE_ACCURACY, QuantileSketch
+
+# Cleaned output of the streaming pipeline
+CLEAN_DATA_PATH = "pollution_clean.parquet"
+
+DEFAULT_MEMORY_LIMIT = 512 * 2 ** 20
+# A chunk is copied a few times while it is parsed, cleaned and converted for writing
+CHUNK_OVERHEAD = 4
+MIN_CHUNKSIZE = 1_000
+
+_SIZE_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+
+
+# Parse a memory size such as 512MB, 2G or 1048576 into bytes
+def parse_size(text):
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*', str(text), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid memory size: {text!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+# Rows per chunk so that a chunk and its working copies fit in `memory_limit` bytes
+def chunksize_for(source, columns=None, memory_limit=DEFAULT_MEMORY_LIMIT):
+    sample = next(iter_data_chunks(source, columns, chunksize=MIN_CHUNKSIZE))
+    sample_bytes = sample.memory_usage(deep=True).sum()
+    if os.path.isfile(source):
+        # The CSV parser holds the raw text of a chunk, which is larger than the typed frame
+        with open(source, 'rb') as handle:
+            sample_bytes = max(sample_bytes, sum(len(handle.readline()) for _ in range(len(sample) + 1)))
+    bytes_per_row = sample_bytes / max(len(sample), 1)
+    return max(MIN_CHUNKSIZE, int(memory_limit / (bytes_per_row * CHUNK_OVERHEAD)))
+
+
+# Chunks of whole site-days, each collapsed to one row per site-day, with the report of
+# collapse_site_days(). The rows of the last site-day of a chunk are held back and
+# prepended to the next chunk; this relies on the rows of a site-day being adjacent, as
+# they are in the EPA export and in the store built from it.
+def iter_site_day_chunks(source, columns=None, chunksize=100_000):
+    carry = None
+    for chunk in iter_data_chunks(source, columns, chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+            carry = None
+        if all(column in chunk.columns for column in SITE_DAY_COLUMNS) and len(chunk):
+            keys = chunk[SITE_DAY_COLUMNS]
+            last = (keys == keys.iloc[-1]).all(axis=1).to_numpy()[::-1]
+            held = len(last) if last.all() else int(np.argmin(last))
+            if held:
+                chunk, carry = chunk.iloc[:len(chunk) - held], chunk.iloc[len(chunk) - held:]
+        if len(chunk):
+            yield collapse_site_days(chunk)
+    if carry is not None:
+        yield collapse_site_days(carry)
+
+
+# Pass 1: sketches of the imputed columns for every imputation level (all rows, as the
+# in-memory pipeline computes the medians before dropping bad dates) and sketches of the
+# outlier columns over rows with a valid date. The whole-number columns (AQI, hours) are
+# counted exactly and the continuous ones sketched within `relative_accuracy`, so memory
+# grows with the number of groups, not of rows. relative_accuracy=0 gives the exact
+# in-memory statistics, at the cost of one count per distinct continuous value.
+def collect_statistics(source, columns=None, chunksize=100_000, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    imputation = None
+    sketches = {column: QuantileSketch(sketch_accuracy(column, relative_accuracy)) for column in POLLUTANT_AQI_COLUMNS}
+    # Missing values per (State, County, City) group among rows with a valid date
+    missing = None
+    rows = 0
+    for chunk, report in iter_site_day_chunks(source, columns, chunksize):
+        rows += report['rows_in']
+        valid = chunk['Date Local'].notna()
+        imputation = merge_imputation_sketches(imputation, imputation_sketches(chunk, relative_accuracy=relative_accuracy))
+        keys = list(dict.fromkeys(key for level in imputation_levels(chunk).values() for key in level))
+        counts = chunk.loc[valid, imputed_columns(chunk)].isna().groupby(
+            [chunk.loc[valid, key].astype(object) for key in keys], dropna=False).sum()
+        missing = counts if missing is None else missing.add(counts, fill_value=0)
+        for column in POLLUTANT_AQI_COLUMNS:
+            sketches[column].update(chunk.loc[valid, column])
+        dtypes = chunk.dtypes
+
+    medians = medians_from_sketches(imputation)
+    # After imputation every missing value of a group takes the same fill value, found by
+    # imputing one all-missing row per group
+    groups = missing.index.to_frame(index=False)
+    for column in missing.columns:
+        groups[column] = pd.Series(float('nan'), index=groups.index, dtype=dtypes[column])
+    groups, _ = fill_medians(groups, medians)
+    for column in POLLUTANT_AQI_COLUMNS:
+        if column in missing.columns:
+            sketches[column].update_repeated(groups[column], missing[column])
+    return rows, medians, bounds_from_sketches(sketches)
+
+
+# Parquet schema of the cleaned data: labels as strings, site codes as int32, measures as float32
+def arrow_schema(data):
+    fields = []
+    for column in data.columns:
+        if column in CATEGORICAL_COLUMNS:
+            fields.append(pa.field(column, pa.string()))
+        elif column in CODE_COLUMNS:
+            fields.append(pa.field(column, pa.int32()))
+        elif column == 'Date Local':
+            fields.append(pa.field(column, pa.from_numpy_dtype(data[column].dtype)))
+        else:
+            fields.append(pa.field(column, pa.float32()))
+    return pa.schema(fields)
+
+
+def arrow_table(data, schema):
+    data = data.copy()
+    for column in data.columns.intersection(CATEGORICAL_COLUMNS):
+        data[column] = data[column].astype(object)
+    return pa.Table.from_pandas(data, schema=schema, preserve_index=False)
+
+
+def _sort_key(value):
+    # Missing labels sort last, as in DataFrame.sort_values
+    return (pd.isna(value), '' if pd.isna(value) else value)
+
+
+# Clean `source` chunk by chunk and write the result to a parquet file sorted by
+# (State, City, Date Local), matching pipeline.preprocess() on the whole file up to the
+# accuracy of the medians below.
+# Pass 2 cleans each chunk with the statistics of pass 1 and spills it per (State, City);
+# pass 3 sorts one City at a time, so peak memory is bounded by the chunk size and the
+# largest City, not by the size of the input.
+# The AQI columns, their outlier bounds and the hour columns are exact; the medians
+# filling the continuous Mean and Max Value columns come from bounded-size quantile
+# sketches (see sketches.py), within `relative_accuracy` of the exact values.
+# relative_accuracy=0 makes them exact too, and the output identical to preprocess().
+def stream_preprocess(source=RAW_DATA_PATH, destination=CLEAN_DATA_PATH, memory_limit=DEFAULT_MEMORY_LIMIT, columns=None,
+                      relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    chunksize = chunksize_for(source, columns, memory_limit)
+    rows_in, medians, bounds = collect_statistics(source, columns, chunksize, relative_accuracy)
+
+    spill_dir = tempfile.mkdtemp(prefix='spill-', dir=os.path.dirname(os.path.abspath(destination)))
+    try:
+        spills = {}
+        schema = None
+        imputed = None
+        removed = 0
+        for number, (chunk, collapsed) in enumerate(iter_site_day_chunks(source, columns, chunksize)):
+            removed += collapsed['rows_removed']
+            chunk, report = fill_medians(chunk, medians)
+            imputed = report if imputed is None else imputed + report
+            chunk = chunk.dropna(subset=['Date Local'])
+            replace_outliers_with_median(chunk, POLLUTANT_AQI_COLUMNS, bounds=bounds)
+            schema = schema or arrow_schema(chunk)
+            table = arrow_table(chunk, schema)
+            keys = chunk[['State', 'City']].astype(object)
+            for key, positions in keys.groupby(['State', 'City'], dropna=False, sort=False).indices.items():
+                directory = spills.setdefault(key, os.path.join(spill_dir, str(len(spills))))
+                os.makedirs(directory, exist_ok=True)
+                pq.write_table(table.take(positions), os.path.join(directory, f'{number}.parquet'))
+
+        rows_out = 0
+        with pq.ParquetWriter(destination, schema) as writer:
+            for key in sorted(spills, key=lambda key: tuple(_sort_key(value) for value in key)):
+                directory = spills[key]
+                parts = sorted(os.listdir(directory), key=lambda name: int(name.split('.')[0]))
+                table = pa.concat_tables([pq.read_table(os.path.join(directory, part)) for part in parts])
+                table = table.take(pc.sort_indices(table, [('Date Local', 'ascending')]))
+                writer.write_table(table)
+                rows_out += table.num_rows
+                shutil.rmtree(directory)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return {'rows_in': rows_in, 'rows_out': rows_out, 'chunksize': chunksize, 'site_day_duplicates': removed,
+            'imputed': imputed}
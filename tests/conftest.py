@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate
+from data_preprocessing import POLLUTANT_AQI_COLUMNS, POLLUTANT_MEAN_COLUMNS, read_raw_csv
+
+
+# Synthetic EPA rows with gaps for every imputation level to fill: scattered missing
+# values, a pollutant missing in a whole State, rows without a city or a date. The sites
+# of the first two States are merged into one State without cities, so that rows of
+# different sites tie on the sort columns, and a few rows are dropped, so that the rows
+# of a site-day do not line up with chunks of the file.
+@pytest.fixture(scope='session')
+def raw_csv(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('data')
+    data = read_raw_csv(generate(20_000, directory / 'synthetic.csv'))
+    rng = np.random.default_rng(0)
+    merged = data['State'].isin(data['State'].cat.categories[:2])
+    data.loc[merged, 'State'] = data['State'].cat.categories[0]
+    data.loc[merged, 'City'] = np.nan
+    for column in POLLUTANT_AQI_COLUMNS + POLLUTANT_MEAN_COLUMNS:
+        data.loc[rng.random(len(data)) < 0.05, column] = np.nan
+    data.loc[data['State'] == data['State'].cat.categories[0], 'O3 AQI'] = np.nan
+    data.loc[rng.random(len(data)) < 0.01, 'City'] = np.nan
+    data.loc[rng.random(len(data)) < 0.001, 'Date Local'] = pd.NaT
+    data = data.drop(index=rng.choice(len(data), 7, replace=False))
+    path = directory / 'pollution.csv'
+    data.assign(**{'Date Local': data['Date Local'].dt.strftime('%Y-%m-%d')}).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture(scope='session')
+def raw(raw_csv):
+    return read_raw_csv(raw_csv)
@@ -0,0 +1,65 @@
+import pandas as pd
+
+from aggregates import build_cube
+from incremental import append_files, incremental_cube, load_incremental
+from pipeline import preprocess
+
+
+def _write_csv(data, path):
+    data.assign(**{'Date Local': data['Date Local'].dt.strftime('%Y-%m-%d')}).to_csv(path, index=False)
+    return path
+
+
+# Rows of a table with its labels as plain columns, in a fixed order, so that tables
+# differing only in the dtype or the order of their labels compare equal
+def _plain(table):
+    levels = table.index.nlevels
+    table = table.reset_index()
+    table = table.astype({column: object for column in table.columns
+                          if table[column].dtype.kind not in 'biufM'})
+    return table.sort_values(list(table.columns[:levels]), kind='stable').reset_index(drop=True)
+
+
+def assert_cube_equal(result, expected):
+    assert result.keys() == expected.keys()
+    for name, table in expected.items():
+        tables = table if name == 'pyramid' else {name: table}
+        results = result[name] if name == 'pyramid' else {name: result[name]}
+        assert results.keys() == tables.keys()
+        for key in tables:
+            pd.testing.assert_frame_equal(_plain(results[key]), _plain(tables[key]), check_dtype=False,
+                                          check_column_type=False, rtol=1e-5)
+
+
+def _categories_as_object(data):
+    return data.astype({column: object for column in data.select_dtypes('category').columns})
+
+
+# With exact sketches, the first append stores the rows of pipeline.preprocess() and
+# keeps the cube aggregates.build_cube() gives for them
+def test_first_append_matches_serial(raw, raw_csv, tmp_path):
+    append_files([raw_csv], tmp_path, relative_accuracy=0)
+    expected = preprocess(raw.copy())
+    pd.testing.assert_frame_equal(_categories_as_object(load_incremental(tmp_path)), _categories_as_object(expected),
+                                  check_dtype=False)
+    assert_cube_equal(incremental_cube(tmp_path), build_cube(expected))
+
+
+# With exact sketches, appending in two steps keeps the cube of the stored rows, the
+# sums of the week at the turn of 2001 and 2002 included, which both steps add rows to.
+# Appending rows already stored changes nothing.
+def test_appends_keep_cube(raw, tmp_path):
+    data = raw.assign(**{'Date Local': raw['Date Local'] + (pd.Timestamp('2001-10-01') - raw['Date Local'].min())})
+    first = data['Date Local'] < pd.Timestamp('2002-01-03')
+    files = [_write_csv(data[first], tmp_path / 'first.csv'), _write_csv(data[~first], tmp_path / 'second.csv')]
+    path = tmp_path / 'dataset'
+    append_files(files[:1], path, relative_accuracy=0)
+    append_files(files[1:], path, relative_accuracy=0)
+    stored = load_incremental(path)
+    assert len(stored) == len(preprocess(data.copy()))
+    assert_cube_equal(incremental_cube(path), build_cube(stored))
+
+    report = append_files(files[1:], path)
+    assert report['rows_out'] == 0
+    pd.testing.assert_frame_equal(load_incremental(path), stored)
+    assert_cube_equal(incremental_cube(path), build_cube(stored))
@@ -0,0 +1,13 @@
+import pandas as pd
+import pytest
+
+from parallel import SHARD_KEYS, preprocess_parallel
+from pipeline import preprocess
+
+
+# The parallel pipeline gives exactly the serial result, values and row order alike
+@pytest.mark.parametrize('shard_by', SHARD_KEYS)
+def test_parallel_matches_serial(raw, shard_by):
+    expected = preprocess(raw.copy())
+    result = preprocess_parallel(raw, workers=2, shard_by=shard_by)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
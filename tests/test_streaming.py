@@ -0,0 +1,16 @@
+import pandas as pd
+
+from data_preprocessing import load_store
+from pipeline import preprocess
+from streaming import MIN_CHUNKSIZE, stream_preprocess
+
+
+# With exact sketches, the chunked pipeline writes exactly the serial result, even in
+# chunks of the smallest size, which cut through site-days and Cities
+def test_stream_matches_serial(raw, raw_csv, tmp_path):
+    destination = tmp_path / 'clean.parquet'
+    report = stream_preprocess(raw_csv, destination, memory_limit=2 ** 16, relative_accuracy=0)
+    assert report['chunksize'] == MIN_CHUNKSIZE
+    expected = preprocess(raw.copy())
+    result = load_store(destination)
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_exact=True, check_categorical=False)
@@ -0,0 +1,131 @@
+import io
+import threading
+from collections import OrderedDict
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pandas as pd
+import plotly.io as pio
+import streamlit as st
+
+from cache import make_key
+from profiling import span, stop_profiling
+
+# Memory budget of the rendered charts kept for reuse, shared by every session
+RENDER_CACHE_BYTES = 64 * 2 ** 20
+# Same resolution as st.pyplot, lowered for wide figures so the PNG is never wider than
+# Streamlit's content width: wider images are resized by st.image on every display
+RENDER_DPI = 200
+MAX_IMAGE_WIDTH_PX = 1460
+
+
+# Least recently used cache of rendered charts (PNG bytes or Plotly JSON), bounded by size
+class RenderCache:
+    def __init__(self, max_bytes=RENDER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= len(self._items.pop(key))
+            # A chart larger than the whole budget is served once and not kept
+            if len(value) > self.max_bytes:
+                return
+            self._items[key] = value
+            self.nbytes += len(value)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+_renders = RenderCache()
+
+
+# A chart is identified by its id, the parameters it was drawn with and the dataset version
+def chart_key(chart_id, params=(), version=None):
+    return make_key(chart_id, repr(tuple(params)), version)
+
+
+# Rasterize a matplotlib figure and close it, whether or not rendering succeeds
+def figure_png(fig):
+    try:
+        buffer = io.BytesIO()
+        dpi = min(RENDER_DPI, MAX_IMAGE_WIDTH_PX / fig.get_figwidth())
+        fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+# PNG of the figure returned by `draw()`, drawn only when not cached yet
+def cached_png(chart_id, draw, params=(), version=None):
+    key = chart_key(chart_id, params, version)
+    png = _renders.get(key)
+    with span('render') as record:
+        record['cache_hit'] = png is not None
+        if png is None:
+            png = figure_png(draw())
+            _renders.put(key, png)
+    return png
+
+
+# Plotly JSON of the figure returned by `draw()`, built only when not cached yet
+def cached_plotly_json(chart_id, draw, params=(), version=None):
+    key = chart_key(chart_id, params, version)
+    figure = _renders.get(key)
+    with span('render') as record:
+        record['cache_hit'] = figure is not None
+        if figure is None:
+            figure = draw().to_json()
+            _renders.put(key, figure)
+    return figure
+
+
+# Drop-in replacements for st.pyplot / st.plotly_chart. `draw` builds the figure and
+# only runs on a cache miss, so it should also do the data preparation for the chart;
+# `params` must cover everything the figure depends on besides the dataset.
+def show_pyplot(chart_id, draw, params=(), version=None):
+    with span(chart_id):
+        st.image(cached_png(chart_id, draw, params, version), width='stretch')
+
+
+def show_plotly(chart_id, draw, params=(), version=None, **kwargs):
+    with span(chart_id):
+        st.plotly_chart(pio.from_json(cached_plotly_json(chart_id, draw, params, version)), **kwargs)
+
+
+# Sidebar table of the spans of this rerun, with their JSON lines for download.
+# Also appends them to profiling.PROFILE_LOG_PATH for external monitoring.
+def show_profile(profiler):
+    # Fragment reruns of single sections are not profiled
+    stop_profiling()
+    if profiler is None:
+        return
+    profiler.write()
+    with st.sidebar.expander("Profile of this rerun", expanded=True):
+        table = pd.DataFrame(profiler.spans)
+        table['name'] = ['  ' * depth + name for depth, name in zip(table['depth'], table['name'])]
+        table['memory_delta_mb'] = pd.to_numeric(table['memory_delta_bytes']) / 2 ** 20
+        columns = ['name', 'wall_s', 'cpu_s', 'rows', 'memory_delta_mb'] + (['cache_hit'] if 'cache_hit' in table else [])
+        st.dataframe(table[columns].round(4), hide_index=True)
+        st.download_button("Download JSON lines", profiler.to_jsonl(), file_name=f"profile-{profiler.run_id}.jsonl",
+                           mime='application/jsonl')